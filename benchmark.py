@@ -0,0 +1,248 @@
+#  benchmark switch, controller, predictor and end-to-end simulation
+
+
+from __future__ import print_function
+from time import time
+import random
+import element
+import setting
+
+
+SEED = 7
+TOPOS = [('single', setting.SINGLE), ('bridge', setting.BRIDGE),
+         ('ge50', setting.GE50), ('brain', setting.BRAIN)]
+
+
+def measure(func, repeat=3):
+    # best wall time of repeat runs; func returns the number of operations
+    best = None
+    for _ in range(repeat):
+        start = time()
+        ops = func()
+        t = time()-start
+        if best is None or t < best:
+            best = t
+    return {'time': best, 'ops': ops, 'per_op': best/max(ops, 1)}
+
+
+def random_ip():
+    return random.randint(0, 0xffffffff)
+
+
+def new_entry(field, priority, match_field, ts=0, timeout=setting.INF):
+    return element.Entry(field, priority, match_field, [(setting.ACT_FWD, 1)],
+                         ts=ts, timeout=timeout,
+                         timeout_type=setting.TIMEOUT_IDLE)
+
+
+def bench_match(size, wildcard, lookups=10000):
+    import switch
+    import traffic
+
+    random.seed(SEED)
+    sw = switch.Switch(0, setting.TYPE_SOFTWARE)
+    dstips = []
+    for _ in range(size):
+        ip = random_ip()
+        if wildcard:
+            mask = random.choice([8, 16, 24])
+            entry = new_entry(setting.FIELD_DSTPREFIX[mask], mask,
+                              element.get_prefix(ip, mask))
+        else:
+            entry = new_entry(setting.FIELD_DSTIP, 32, ip)
+        sw.add_entry(entry)
+        dstips.append(ip)
+    pkts = [traffic.Packet((random_ip(), random.choice(dstips),
+                            random.randint(1, 65535), random.randint(1, 65535), 6))
+            for _ in range(lookups)]
+
+    def run():
+        sw.flush_cache()
+        for pkt in pkts:
+            sw.get_match_entry(pkt)
+        return len(pkts)
+
+    name = 'switch.get_match_entry.{}'.format('wildcard' if wildcard else 'exact')
+    return dict(name=name, size=size, **measure(run))
+
+
+def bench_update(size, rounds=100):
+    import switch
+
+    random.seed(SEED)
+    timeout = 1e6
+    entries = [new_entry(setting.FIELD_DSTIP, 32, random_ip(),
+                         ts=random.uniform(0, timeout), timeout=timeout)
+               for _ in range(size)]
+
+    def run():  # expire the whole table over rounds updates
+        sw = switch.Switch(0, setting.TYPE_SOFTWARE)
+        for entry in entries:
+            sw.add_entry(entry)
+        for i in range(rounds):
+            sw.update(timeout+(i+1)*timeout/rounds)
+        return rounds
+
+    return dict(name='switch.update', size=size, **measure(run))
+
+
+def bench_depset(size, rate=0.2):
+    import ruleset
+
+    random.seed(SEED)
+    rules = set()
+    for _ in range(size):
+        ip = random_ip() & 0xffff00ff  # few subnets, many overlaps
+        if random.random() < rate:
+            rules.add((24, element.get_prefix(ip, 24)))
+        else:
+            rules.add((32, ip))
+
+    def run():
+        rs = ruleset.Ruleset()
+        rs.ruleset = set(rules)
+        rs.get_depset(setting.INF)
+        return len(rules)
+
+    return dict(name='ruleset.get_depset', size=size, **measure(run))
+
+
+def bench_spath(topo_name, topo):
+    def run():
+        for src in range(len(topo)):
+            element.shortest_pathes(topo, src)
+        return len(topo)
+
+    return dict(name='element.shortest_pathes', topo=topo_name, **measure(run))
+
+
+def new_training_data(predictor, size):
+    random.seed(SEED)
+    for _ in range(size):
+        x = (random.uniform(0, 10), random.randint(0, 100))
+        x_ = (x[0]+random.uniform(1, 10), x[1]+random.randint(0, 100))
+        a = random.randint(0, predictor.action_cnt-1)
+        predictor.training_data.append((x, a, x_, random.random()))
+    return
+
+
+def bench_qtrain(steps=1000):
+    import predict
+
+    q = predict.QPredictor()
+    q.init(1)
+    new_training_data(q, 10000)
+
+    def run():
+        for _ in range(steps):
+            q.train()
+        return steps
+
+    return dict(name='QPredictor.train', **measure(run))
+
+
+def bench_dqn_predict(calls=100):
+    import predict
+
+    random.seed(SEED)
+    dqn = predict.DQNPredictor()
+    dqn.init(1)
+    dqn.epsilon = 0  # always query the model
+    rules = [(32, random_ip()) for _ in range(calls)]
+
+    def run():
+        for rule in rules:
+            dqn.predict(rule, 0, 0)
+        return calls
+
+    return dict(name='DQNPredictor.predict', **measure(run))
+
+
+def bench_simulate(topo_name, topo, flows, burst_max=20,
+                   mode=setting.MODE_IDLE, predictor_name=setting.PREDICTOR_DEFAULT):
+    import os
+    import shutil
+    import tempfile
+    import network
+    import simulate
+
+    random.seed(SEED)
+    switch_num = len(topo)
+    prob = 1.0/(switch_num*(switch_num-1))
+    mat = [[0 if i == j else prob for j in range(switch_num)]
+           for i in range(switch_num)]
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        n = network.Network(topo)
+        n.generate_random_traffic(mat, flows, burst_max)
+        pktnum = len(n.traffic.pkts)
+        para = {'net': n, 'mode': mode,
+                'log_prefix': os.path.join(tmp_dir, topo_name),
+                'check_interval': max(flows//10, 1),
+                'predictor_name': predictor_name,
+                'update_interval': setting.DEFAULT_UPDATE}
+        start = time()
+        d = simulate.simulate(para)
+        t = time()-start
+    finally:
+        shutil.rmtree(tmp_dir)
+    return {'name': 'simulate.simulate', 'topo': topo_name, 'flows': flows,
+            'time': t, 'ops': pktnum, 'per_op': t/max(pktnum, 1),
+            'pps': pktnum/t if t > 0 else None, 'pktin': d.pktin['pktin'][-1]}
+
+
+def get_version():
+    from subprocess import Popen, PIPE
+    try:
+        proc = Popen(['git', 'rev-parse', 'HEAD'], stdout=PIPE, stderr=PIPE)
+        out = proc.communicate()[0]
+    except OSError:
+        return None
+    if proc.returncode != 0:
+        return None
+    return out.decode().strip()
+
+
+def run_all(scale=1.0):
+    """every benchmark on reproducible synthetic inputs; scale shrinks or
+    grows the input sizes. A benchmark whose optional dependency (keras)
+    is missing is recorded as skipped.
+    """
+    size = lambda x: max(int(x*scale), 1)
+    benches = [(bench_match, (size(3000), False)),
+               (bench_match, (size(3000), True))]
+    benches += [(bench_update, (size(s),)) for s in [1000, 3000, 30000]]
+    benches += [(bench_depset, (size(s),)) for s in [1000, 3000]]
+    benches += [(bench_spath, ('ge50', setting.GE50)),
+                (bench_spath, ('brain', setting.BRAIN))]
+    benches += [(bench_qtrain, ()), (bench_dqn_predict, ())]
+    benches += [(bench_simulate, (name, topo, size(1000)))
+                for (name, topo) in TOPOS]
+
+    results = []
+    for (bench, args) in benches:
+        print('running {}{}'.format(bench.__name__, args[:1]))
+        try:
+            results.append(bench(*args))
+        except ImportError as e:
+            # args tell skipped runs apart; topologies go by the name before them
+            results.append({'name': bench.__name__, 'skipped': str(e),
+                            'args': [a for a in args if not isinstance(a, list)]})
+    return results
+
+
+if __name__ == '__main__':
+    from sys import argv, version
+    from json import dumps
+
+    out_file = 'benchmark.json'
+    scale = 1.0
+    if len(argv) >= 2:
+        out_file = argv[1]
+    if len(argv) == 3:
+        scale = float(argv[2])
+
+    report = {'version': get_version(), 'python': version.split()[0],
+              'time': time(), 'scale': scale, 'results': run_all(scale)}
+    with open(out_file, 'w') as f:
+        print(dumps(report), file=f)
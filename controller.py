@@ -15,9 +15,11 @@ class Controller:
 
         self.shortest_pathes = {label: {} for label in range(self.switch_num)}
         self.get_shortest_pathes()
+        self.get_path_tables()
 
         if ruleset_pkl is not None:
             self.ruleset = element.de_serialize(ruleset_pkl)
+            self.ruleset.normalize_addr()
 
         self.install_num = {}
         self.predictor = None
@@ -62,6 +64,55 @@ class Controller:
                 self.shortest_pathes[src][dst] = [sp for (delay, sp) in spathes[dst]]
         return
 
+    def get_path_tables(self):
+        """Per-topology tables. A traversed path is interned as a path id in
+        a trie over switch labels (id 0 is the empty path) with its delay 
+        coefficients (link hops, forwarding delay); routes[src][dst] lists the
+        (hop, next hop) pairs of the first shortest path.
+        """
+        self.hop_delay = [setting.HARDWARE_FWD_DELAY]*self.switch_num
+        if self.soft_labels is not None:
+            for label in self.soft_labels:
+                self.hop_delay[label] = setting.SOFTWARE_FWD_DELAY
+        self.path_next = [{}]
+        self.path_tail = [(None, None)]  # (parent id, last hop)
+        self.path_coef = [(-1, 0)]
+
+        self.routes = [[None]*self.switch_num for _ in range(self.switch_num)]
+        for src in range(self.switch_num):
+            for dst in range(self.switch_num):
+                path = self.shortest_pathes[src][dst][0]
+                self.routes[src][dst] = [(path[cnt], path[cnt+1]) 
+                                         for cnt in range(len(path)-1)]
+                pid = 0
+                for hop in path:
+                    pid = self.extend_path(pid, hop)
+        return
+
+    def extend_path(self, pid, label):
+        nxt = self.path_next[pid]
+        if label not in nxt:
+            (links, fwd) = self.path_coef[pid]
+            nxt[label] = len(self.path_coef)
+            self.path_next.append({})
+            self.path_tail.append((pid, label))
+            self.path_coef.append((links+1, fwd+self.hop_delay[label]))
+        return nxt[label]
+
+    def get_path(self, pid):
+        path = []
+        while pid != 0:
+            (pid, label) = self.path_tail[pid]
+            path.append(label)
+        path.reverse()
+        return path
+
+    def get_path_delay(self, pid, pktin=0, size=1500):
+        # same as get_delay on the path with a CTRL hop after each packet-in
+        (links, fwd) = self.path_coef[pid]
+        return (setting.LINK_RATE*size*(links+pktin) + fwd + 
+                pktin*setting.CONTROLLER_DELAY)
+
     def packet_in(self, label, pkt, curtime, mode=setting.MODE_DEFAULT):
         if mode == setting.MODE_DEFAULT:  # install exact-match 5-tuple rules hop-by-hop
             return self.packet_in_default(label, pkt, curtime)
@@ -77,12 +128,11 @@ class Controller:
             raise NameError('Error. No such packet-in mode. Exit.')
 
     def packet_in_default(self, label, pkt, curtime):  
-        dst = pkt.dst
-        path = self.shortest_pathes[label][dst][0]
+        (_, next_hop) = self.routes[label][pkt.dst][0]
         field = setting.FIELD_TP
         priority = 40
         match_field = pkt.tp
-        action = [(setting.ACT_FWD, path[1])]
+        action = [(setting.ACT_FWD, next_hop)]
         entry = element.Entry(field, priority, match_field, action, 
                               flag=setting.FLAG_REMOVE_NOTIFY, 
                               ts=curtime, timeout=setting.DEFAULT_TIMEOUT, 
@@ -91,26 +141,24 @@ class Controller:
         return inst
 
     def packet_in_spath(self, label, pkt, curtime):  
-        dst = pkt.dst
-        path = self.shortest_pathes[label][dst][0]
+        route = self.routes[label][pkt.dst]
         instractions = []
         field = setting.FIELD_TP
         priority = 40
         match_field = pkt.tp
-        for cnt in range(len(path)-1):
-            action = [(setting.ACT_FWD, path[cnt+1])]
+        for (hop, next_hop) in route:
+            action = [(setting.ACT_FWD, next_hop)]
             entry = element.Entry(field, priority, match_field, action, 
                                   flag=setting.FLAG_REMOVE_NOTIFY, 
                                   ts=curtime, timeout=setting.DEFAULT_TIMEOUT, 
                                   timeout_type=setting.TIMEOUT_IDLE)  # 1s idle timeout
-            inst = (setting.INST_ADD, path[cnt], entry)
+            inst = (setting.INST_ADD, hop, entry)
             instractions.append(inst)
         return instractions
         
     def packet_in_idle(self, label, pkt, curtime):
         instractions = []
-        dst = pkt.dst
-        path = self.shortest_pathes[label][dst][0]
+        route = self.routes[label][pkt.dst]
         field = setting.FIELD_DSTIP
         priority = 32
         match_field = pkt.dstip
@@ -125,13 +173,13 @@ class Controller:
             rule = (32, match_field)
             timeout = self.predictor.predict(rule, curtime, label)
 
-        for cnt in range(len(path)-1):
-            action = [(setting.ACT_FWD, path[cnt+1])]
+        for (hop, next_hop) in route:
+            action = [(setting.ACT_FWD, next_hop)]
             entry = element.Entry(field, priority, match_field, action, 
                                   flag=setting.FLAG_REMOVE_NOTIFY, 
                                   ts=curtime, timeout=timeout, 
                                   timeout_type=setting.TIMEOUT_IDLE)
-            instractions.append((setting.INST_ADD, path[cnt], entry))
+            instractions.append((setting.INST_ADD, hop, entry))
             self.record_install((32, match_field))
         return instractions
 
@@ -148,8 +196,7 @@ class Controller:
             timeout = self.predictor.predict(rule, curtime, label)
 
         instractions = []
-        dst = pkt.dst
-        path = self.shortest_pathes[label][dst][0]    
+        route = self.routes[label][pkt.dst]
         if rule[0] == 32:
             field = setting.FIELD_DSTIP
             priority = 32
@@ -157,12 +204,12 @@ class Controller:
             field = setting.FIELD_DSTPREFIX[rule[0]]
             priority = rule[0]
         match_field = rule[1]
-        for cnt in range(len(path)-1):
-            action = [(setting.ACT_FWD, path[cnt+1])]
+        for (hop, next_hop) in route:
+            action = [(setting.ACT_FWD, next_hop)]
             entry = element.Entry(field, priority, match_field, action, 
                                   flag=setting.FLAG_REMOVE_NOTIFY, ts=curtime, 
                                   timeout=timeout, timeout_type=setting.TIMEOUT_HARD)
-            instractions.append((setting.INST_ADD, path[cnt], entry))
+            instractions.append((setting.INST_ADD, hop, entry))
             self.record_install(rule)
 
         for r in deprules:
@@ -173,12 +220,12 @@ class Controller:
                 field = setting.FIELD_DSTPREFIX[r[0]]
                 priority = r[0]
             match_field = r[1]
-            for cnt in range(len(path)-1):
-                action = [(setting.ACT_FWD, path[cnt+1])]
+            for (hop, next_hop) in route:
+                action = [(setting.ACT_FWD, next_hop)]
                 entry = element.Entry(field, priority, match_field, action, 
                                       flag=None, ts=curtime, 
                                       timeout=timeout, timeout_type=setting.TIMEOUT_HARD)
-                instractions.append((setting.INST_ADD, path[cnt], entry))
+                instractions.append((setting.INST_ADD, hop, entry))
                 self.record_install(r)
 
         return instractions
@@ -196,8 +243,7 @@ class Controller:
             timeout = self.predictor.predict(rule, curtime, label)
 
         instractions = []
-        dst = pkt.dst
-        path = self.shortest_pathes[label][dst][0]
+        route = self.routes[label][pkt.dst]
         if rule[0] == 32:
             field = setting.FIELD_DSTIP
             priority = 32
@@ -205,12 +251,12 @@ class Controller:
             field = setting.FIELD_DSTPREFIX[rule[0]]
             priority = rule[0]
         match_field = rule[1]
-        for cnt in range(len(path)-1):
-            action = [(setting.ACT_FWD, path[cnt+1])]
+        for (hop, next_hop) in route:
+            action = [(setting.ACT_FWD, next_hop)]
             entry = element.Entry(field, priority, match_field, action, 
                                   flag=setting.FLAG_REMOVE_NOTIFY, ts=curtime, 
                                   timeout=timeout, timeout_type=setting.TIMEOUT_IDLE)
-            instractions.append((setting.INST_ADD, path[cnt], entry))
+            instractions.append((setting.INST_ADD, hop, entry))
             self.record_install(rule)
 
         for r in deprules:
@@ -221,13 +267,13 @@ class Controller:
                 field = setting.FIELD_DSTPREFIX[r[0]]
                 priority = r[0]
             match_field = r[1]
-            for cnt in range(len(path)-1):
-                action = [(setting.ACT_FWD, path[cnt+1])]
+            for (hop, next_hop) in route:
+                action = [(setting.ACT_FWD, next_hop)]
                 entry = element.Entry(field, priority, match_field, action, 
                                       flag=None, ts=curtime, 
                                       timeout=setting.INF, 
                                       timeout_type=setting.TIMEOUT_HARD)
-                instractions.append((setting.INST_ADD, path[cnt], entry))
+                instractions.append((setting.INST_ADD, hop, entry))
                 self.record_install(r)
             
         return instractions
@@ -270,7 +316,7 @@ class Controller:
                     if r[0] == 32:
                         entry = element.Entry(setting.FIELD_DSTIP, 32, r[1], None)
                     else:
-                        entry = element.Entry(setting.FIELD_DSTPREFIX, r[0], r[1], None)
+                        entry = element.Entry(setting.FIELD_DSTPREFIX[r[0]], r[0], r[1], None)
                     instractions.append((setting.INST_DELETE, label, entry))
         return instractions
 
@@ -286,3 +332,14 @@ if __name__ == '__main__':
             
     assert int(c.get_delay([0, setting.CTRL, 1])) == 4034
     assert int(c.get_delay([0, 2, 1])) == 69
+
+    pid = 0
+    for hop in [0, 0, 2, 1]:
+        pid = c.extend_path(pid, hop)
+    assert c.get_path(pid) == [0, 0, 2, 1]
+    assert c.get_path_delay(pid, 1) == c.get_delay([0, setting.CTRL, 0, 2, 1])
+    assert c.extend_path(c.extend_path(0, 0), 0) == c.path_tail[c.path_tail[pid][0]][0]
+    for src in range(c.switch_num):
+        for dst in range(c.switch_num):
+            path = c.shortest_pathes[src][dst][0]
+            assert [hop for (hop, _) in c.routes[src][dst]] == path[:-1]
@@ -15,10 +15,10 @@ class Data:
         self.totinstall = {'flownum': [], 'totinstall': []}
         self.pktnum = {'flownum': [], 'pktnum': []}
 
-        self.fct = {}
+        # per flow id (see Packet.flow); None for flows not seen yet
+        self.fct = []
         self.threshold = 102400  # 100KB
-        self.burst_fct = {}
-        self.tail_fct = {}
+        self.tail = []  # whether the flow is larger than threshold
         self.install_num = {}
 
     def record(self, flownum, delay, totentry, overflow, pktin, totinstall, pktnum):
@@ -36,24 +36,31 @@ class Data:
         self.pktnum['pktnum'].append(pktnum)
         return
 
-    def record_fct(self, tp, pkttime, flowsize):
-        if tp in self.fct:
-            self.fct[tp] += pkttime
+    def record_fct(self, flow, pkttime, flowsize=None):
+        fct = self.fct
+        if flow >= len(fct):
+            fct.extend([None]*(flow+1-len(fct)))
+            self.tail.extend([None]*(flow+1-len(self.tail)))
+        if fct[flow] is None:
+            fct[flow] = pkttime
         else:
-            self.fct[tp] = pkttime
+            fct[flow] += pkttime
 
-        if flowsize > self.threshold:
-            if tp in self.tail_fct:
-                self.tail_fct[tp] += pkttime
-            else:
-                self.tail_fct[tp] = pkttime
-        else:
-            if tp in self.burst_fct:
-                self.burst_fct[tp] += pkttime
-            else:
-                self.burst_fct[tp] = pkttime
+        if flowsize is not None:  # else unknown yet; see split_fct
+            self.tail[flow] = flowsize > self.threshold
+        return
+
+    def split_fct(self, get_flowsize):
+        # burst/tail flows once flow sizes are final
+        for flow in range(len(self.fct)):
+            if self.fct[flow] is not None:
+                self.tail[flow] = get_flowsize(flow) > self.threshold
         return
 
+    def get_fct(self, tail):  # fct of the tail (or burst) flows
+        return [self.fct[flow] for flow in range(len(self.fct)) 
+                if self.tail[flow] is tail]
+
     def record_install_num(self, install_num):
         self.install_num = install_num
 
@@ -69,8 +76,7 @@ class Data:
             print('{} {}'.format(time()-self.start, fnum), file=f)
         return
 
-    def get_fct_cdf(self, fct):
-        delay_list = fct.values()
+    def get_fct_cdf(self, delay_list):
         [xlist, cplist] = element.get_cdf(delay_list)
         cdf = {'x': xlist, 'y': cplist}
 
@@ -85,7 +91,7 @@ class Data:
             print(json.dumps(self.totinstall), file=f)
         with open(fileprefix+'_pktnum.json', 'w') as f:
             print(json.dumps(self.pktnum), file=f)
-        tail_fct_cdf = self.get_fct_cdf(self.tail_fct)
+        tail_fct_cdf = self.get_fct_cdf(self.get_fct(True))
         with open(fileprefix+'_tail_fct_cdf.json', 'w') as f:
             print(json.dumps(tail_fct_cdf), file=f)
         install_num_cdf = self.get_install_num_cdf()
@@ -2,12 +2,21 @@
 
 
 from __future__ import print_function
+from struct import pack, unpack
+from socket import inet_aton, inet_ntoa
 import setting
 
 
-class Entry:
+class Entry(object):
+    # ts, timeout and timeout_type are only set for entries with a timeout
+    __slots__ = ('field', 'priority', 'match_field', 'action', 'flag', 
+                 'counter', 'ts', 'timeout', 'timeout_type')
+
     def __init__(self, field, priority, match_field, action, flag=None,
                  ts=None, timeout=None, timeout_type=None):
+        if isinstance(match_field, (str, tuple)):  # dotted-quad input
+            match_field = addr2int(match_field)
+
         self.field = field
         self.priority = priority
         self.match_field = match_field
@@ -28,12 +37,21 @@ class Entry:
                 self.priority == e.priority and 
                 self.match_field == e.match_field)
 
+    def __getstate__(self):
+        return {name: getattr(self, name) for name in self.__slots__ 
+                if hasattr(self, name)}
+
+    def __setstate__(self, state):
+        for name in state:
+            setattr(self, name, state[name])
+
     def __repr__(self):
         return 'Entry()'
 
     def __str__(self):
         s = 'filed:{}, priority:{}, match field:{}, action:{}, flag:{}, counter:{}'.format(
-            self.field, self.priority, self.match_field, self.action, self.flag, self.counter)
+            self.field, self.priority, addr2str(self.match_field), self.action, 
+            self.flag, self.counter)
         if hasattr(self, 'ts'):
             s = '{}, ts:{}, timeout:{}, timeout type:{}'.format(
                 s, self.ts, self.timeout, self.timeout_type)
@@ -42,7 +60,7 @@ class Entry:
     def print_entry(self, filename=None):
         print('field:%s, priority:%s, match field:%s, action:%s, cnt:%d' % (
               self.field, self.priority,
-              self.match_field, self.action,
+              addr2str(self.match_field), self.action,
               self.counter), file=filename)
         return 0
 
@@ -50,32 +68,93 @@ class Entry:
     #     return '{}:{}:{}'.format(self.field, self.priority, self.match_field)
 
 
+"""addresses are carried as 32-bit integers; dotted-quad strings are only
+accepted at input and produced at output
+"""
 def ip2int(addr):
-    from struct import unpack
-    from socket import inet_aton
     return unpack("!I", inet_aton(addr))[0]
 
 
 def int2ip(addr):
-    from struct import pack
-    from socket import inet_ntoa
     return inet_ntoa(pack("!I", addr))
 
 
+def tp2int(tp):
+    return (ip2int(tp[0]), ip2int(tp[1]))+tuple(tp[2:])
+
+
+def tp2str(tp):
+    return (int2ip(tp[0]), int2ip(tp[1]))+tuple(tp[2:])
+
+
+def addr2int(addr):
+    # ip or tp in dotted-quad form -> integer form; others are returned as is
+    if isinstance(addr, str):
+        return ip2int(addr)
+    if isinstance(addr, tuple) and len(addr) >= 2 and isinstance(addr[0], str):
+        return tp2int(addr)
+    return addr
+
+
+def addr2str(addr):
+    # ip or tp in integer form -> dotted-quad form; others are returned as is
+    if isinstance(addr, tuple):
+        if len(addr) >= 2 and not isinstance(addr[0], str):
+            return tp2str(addr)
+        return addr
+    if addr is None or isinstance(addr, str):
+        return addr
+    return int2ip(addr)
+
+
+def get_subnet(ipval):  # *.*.sub.* identifies the attached switch
+    return (ipval >> 8) & 0xff
+
+
+def get_prefix(ipval, mask):
+    return (ipval >> (32-mask)) << (32-mask)
+
+
 def get_ip_range(ip, mask):
-    ipval = ip2int(ip)
-    ipbin = '{0:032b}'.format(ipval)
-    ipmax = int(ipbin[0:mask]+(32-mask)*'1', 2)
-    ipmin = int(ipbin[0:mask]+(32-mask)*'0', 2)
+    ipval = addr2int(ip)
+    hostmask = (1 << (32-mask))-1
+    ipmin = ipval & (0xffffffff ^ hostmask)
+    ipmax = ipval | hostmask
     return [ipmin, ipmax]
 
 
 def match_ip(match_field, ip):
     ip_range = get_ip_range(match_field[0], match_field[1])
-    ipval = ip2int(ip)
+    ipval = addr2int(ip)
     return ip_range[0] <= ipval <= ip_range[1]
 
 
+def new_prefix_trie():
+    return [None, None, None]
+
+
+def prefix_trie_add(trie, ipval, mask):
+    # binary trie of prefixes: [child0, child1, mask if a prefix ends here]
+    node = trie
+    for shift in range(31, 31-mask, -1):
+        bit = (ipval >> shift) & 1
+        if node[bit] is None:
+            node[bit] = [None, None, None]
+        node = node[bit]
+    node[2] = mask
+
+
+def prefix_trie_match(trie, ipval):  # mask of the longest prefix matching
+    (node, best) = (trie, trie[2])
+    for shift in range(31, -1, -1):
+        node = node[(ipval >> shift) & 1]
+        if node is None:
+            break
+        if node[2] is not None:
+            best = node[2]
+    return best
+
+
 def pdf2cdf_1d(pdf_mat):
     from copy import deepcopy
     cp = 0.0
@@ -135,13 +214,19 @@ def test_float_list_identical(l1, l2, precision=setting.DEFAULT_PRECISION):
 
 
 def serialize(o, pkl_file):
-    from pickle import dump, HIGHEST_PROTOCOL
+    try:
+        from cPickle import dump, HIGHEST_PROTOCOL
+    except ImportError:
+        from pickle import dump, HIGHEST_PROTOCOL
     with open(pkl_file, 'wb') as obj:
         dump(o, obj, HIGHEST_PROTOCOL)
 
 
 def de_serialize(pkl_file):
-    from pickle import load
+    try:
+        from cPickle import load
+    except ImportError:
+        from pickle import load
     with open(pkl_file, 'rb') as obj:
         o = load(obj)
     return o
@@ -210,15 +295,51 @@ def get_shortest_pathes(topo, exclude_points=None):
     return all_spathes
 
 
-def zipf(burst_max, exp=1):
+def zipf_pdf(burst_max, exp=1):  # P(burst = n) for n in 1..burst_max
     pdf_mat = [1.0/(n**exp) for n in range(1, burst_max+1)]
     s = sum(pdf_mat)
-    pdf_mat = [1.0*p/s for p in pdf_mat]
-    cdf_mat = pdf2cdf_1d(pdf_mat) 
-    # print(pdf_mat); print(cdf_mat)
+    return [1.0*p/s for p in pdf_mat]
+
+
+def zipf(burst_max, exp=1):
+    cdf_mat = pdf2cdf_1d(zipf_pdf(burst_max, exp))
+    # print(cdf_mat)
     return sample_1d(cdf_mat)+1
 
 
+def alias_table(pdf):
+    """Vose's alias table of a discrete distribution (weights need not be 
+    normalized): [prob, alias] arrays such that alias_sample draws index i 
+    with probability pdf[i] in O(1)
+    """
+    import numpy
+    n = len(pdf)
+    tot = float(sum(pdf))
+    scaled = [1.0*p*n/tot for p in pdf]
+    prob = numpy.ones(n)
+    alias = numpy.arange(n)
+    small = [i for i in range(n) if scaled[i] < 1.0]
+    large = [i for i in range(n) if scaled[i] >= 1.0]
+    while small and large:
+        s = small.pop()
+        l = large.pop()
+        prob[s] = scaled[s]
+        alias[s] = l
+        scaled[l] += scaled[s]-1.0
+        if scaled[l] < 1.0:
+            small.append(l)
+        else:
+            large.append(l)
+    return [prob, alias]  # leftovers keep prob 1 (rounding)
+
+
+def alias_sample(table, size, rng):  # size indices drawn with a RandomState
+    import numpy
+    [prob, alias] = table
+    i = rng.randint(0, len(prob), size)
+    return numpy.where(rng.random_sample(size) < prob[i], i, alias[i])
+
+
 def get_cdf(data_list):
     cnt = {}
     s = len(data_list)
@@ -242,6 +363,13 @@ if __name__ == '__main__':
     assert ip == int2ip(ip2int(ip))
     ipval = 65535
     assert ipval == ip2int(int2ip(ipval))
+    tp = ('1.2.3.4', '5.6.7.8', 80, 8080, 6)
+    assert tp == tp2str(tp2int(tp))
+    assert addr2int(ip) == ip2int(ip) and addr2str(ip2int(ip)) == ip
+    assert get_subnet(ip2int(ip)) == 3
+    assert get_prefix(ip2int(ip), 24) == ip2int('1.2.3.0')
+    assert get_ip_range(ip, 0) == [0, 0xffffffff]
+    assert get_ip_range(ip2int(ip), 30) == [ip2int('1.2.3.4'), ip2int('1.2.3.7')]
     
     assert match_ip(('1.2.3.4', 24), '1.2.3.0')
     assert match_ip(('1.2.3.4', 24), '1.2.3.255')
@@ -263,4 +391,25 @@ if __name__ == '__main__':
     data_list = [2, 1, 3, 3, 4]
     [xlist, cplist] = get_cdf(data_list)
     assert xlist == [1, 2, 3, 4]
-    assert cplist == [0.2, 0.4, 0.8, 1.0]
\ No newline at end of file
+    assert cplist == [0.2, 0.4, 0.8, 1.0]
+    import numpy
+    pdf = [0.5, 0.0, 0.2, 0.3]
+    [prob, alias] = alias_table(pdf)
+    mass = numpy.array(prob)  # each index keeps prob, its aliases get the rest
+    for i in range(len(pdf)):
+        mass[alias[i]] += 1.0-prob[i]
+    assert numpy.allclose(mass/len(pdf), pdf)
+    rng = numpy.random.RandomState(1)
+    draws = alias_sample([prob, alias], 100000, rng)
+    assert numpy.allclose(numpy.bincount(draws, minlength=4)/1e5, pdf, atol=0.01)
+
+    trie = new_prefix_trie()
+    assert prefix_trie_match(trie, ip2int('10.1.2.3')) is None
+    for (ip, mask) in [('10.0.0.0', 8), ('10.1.0.0', 16), ('10.1.2.3', 32)]:
+        prefix_trie_add(trie, ip2int(ip), mask)
+    assert prefix_trie_match(trie, ip2int('10.1.2.3')) == 32
+    assert prefix_trie_match(trie, ip2int('10.1.2.4')) == 16
+    assert prefix_trie_match(trie, ip2int('10.2.0.0')) == 8
+    assert prefix_trie_match(trie, ip2int('11.0.0.0')) is None
+    prefix_trie_add(trie, 0, 0)
+    assert prefix_trie_match(trie, ip2int('11.0.0.0')) == 0
@@ -0,0 +1,43 @@
+#  implement the event queue of the discrete-event simulator
+
+
+from __future__ import print_function
+from heapq import heappush, heappop
+from itertools import count
+import setting
+
+
+class EventQueue:
+    """events = (time, kind, seq, content); same-time events fire by kind 
+    (setting.EVENT_*), then in insertion order
+    """
+    def __init__(self):
+        self.heap = []
+        self.seq = count()
+
+    def __len__(self):
+        return len(self.heap)
+
+    def push(self, time, kind, cont=None):
+        heappush(self.heap, (time, kind, next(self.seq), cont))
+        return
+
+    def pop(self):
+        (time, kind, _, cont) = heappop(self.heap)
+        return (time, kind, cont)
+
+    def empty(self):
+        return len(self.heap) == 0
+
+
+if __name__ == '__main__':
+    q = EventQueue()
+    q.push(5, setting.EVENT_ARRIVAL, 'a')
+    q.push(5, setting.EVENT_EXPIRE, 'b')
+    q.push(1, setting.EVENT_TICK, 'c')
+    q.push(5, setting.EVENT_EXPIRE, 'd')
+    assert len(q) == 4
+    order = []
+    while not q.empty():
+        order.append(q.pop()[2])
+    assert order == ['c', 'b', 'd', 'a']
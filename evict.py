@@ -0,0 +1,216 @@
+#  implement flow table eviction policies
+
+
+from __future__ import print_function
+from heapq import heappush, heappop, heapify
+from collections import OrderedDict
+import setting
+
+
+def get_key(entry):
+    return (entry.field, entry.match_field)
+
+
+def get_evictor(policy):
+    if policy == setting.EVICT_FIFO:
+        return Evictor()
+    elif policy == setting.EVICT_LRU:
+        return LRUEvictor()
+    elif policy == setting.EVICT_LFU:
+        return LFUEvictor()
+    else:
+        raise NameError('Error. No such eviction policy. Exit.')
+
+
+class Evictor:
+    """FIFO: evict entries with the oldest ts first. Idle hits refresh ts, so
+    heap keys may be stale; a surfaced stale key is re-pushed (lazy deletion).
+    Ties in ts go to the entry added, or re-keyed, first. The old full sort 
+    broke them in flow-table order instead, so runs whose tables overflow 
+    are not comparable with runs made before this evictor.
+    """
+    def __init__(self):
+        self.name = setting.EVICT_FIFO
+        self.entries = {}
+        self.heap = []
+        self.seq = 0  # last tiebreaker issued; a plain int pickles as is
+
+    def get_ts(self, entry):
+        return getattr(entry, 'ts', -setting.INF)
+
+    def add(self, entry):
+        self.entries[get_key(entry)] = entry
+        self.seq += 1
+        heappush(self.heap, (self.get_ts(entry), self.seq, entry))
+        return
+
+    def remove(self, entry):
+        key = get_key(entry)
+        if self.entries.get(key) is entry:
+            del self.entries[key]
+            self.compact()
+        return
+
+    def compact(self):  # drop dead heap items once they outnumber live ones
+        heap = self.heap
+        if len(heap) > 2*len(self.entries)+64:
+            heap[:] = [item for item in heap
+                       if self.entries.get(get_key(item[2])) is item[2]]
+            heapify(heap)
+        return
+
+    def hit(self, entry):
+        return
+
+    def evict(self, num):
+        victims = []
+        heap = self.heap
+        while heap and len(victims) < num:
+            (ts, _, entry) = heappop(heap)
+            if self.entries.get(get_key(entry)) is not entry:
+                continue
+            if self.get_ts(entry) != ts:
+                self.seq += 1
+                heappush(heap, (self.get_ts(entry), self.seq, entry))
+                continue
+            self.remove(entry)
+            victims.append(entry)
+        return victims
+
+
+class LRUEvictor(Evictor):
+    """LRU: entries kept in recency order; a hit moves the entry to the tail
+    """
+    def __init__(self):
+        Evictor.__init__(self)
+        self.name = setting.EVICT_LRU
+        self.entries = OrderedDict()
+
+    def add(self, entry):
+        self.entries[get_key(entry)] = entry
+        return
+
+    def hit(self, entry):
+        key = get_key(entry)
+        if self.entries.get(key) is entry:
+            del self.entries[key]
+            self.entries[key] = entry
+        return
+
+    def evict(self, num):
+        victims = []
+        while self.entries and len(victims) < num:
+            (_, entry) = self.entries.popitem(last=False)
+            victims.append(entry)
+        return victims
+
+
+class LFUEvictor(Evictor):
+    """LFU: entries bucketed by counter, FIFO within a bucket; a heap of
+    bucket counters finds the least frequently used bucket
+    """
+    def __init__(self):
+        Evictor.__init__(self)
+        self.name = setting.EVICT_LFU
+        self.freq = {}
+        self.buckets = {}
+        self.counters = []
+
+    def bucket_add(self, key, entry, cnt):
+        self.freq[key] = cnt
+        if cnt not in self.buckets:
+            self.buckets[cnt] = OrderedDict()
+            heappush(self.counters, cnt)
+            if len(self.counters) > 2*len(self.buckets)+64:
+                self.counters = list(self.buckets)
+                heapify(self.counters)
+        self.buckets[cnt][key] = entry
+        return
+
+    def bucket_remove(self, key):
+        cnt = self.freq.pop(key)
+        bucket = self.buckets[cnt]
+        del bucket[key]
+        if len(bucket) == 0:
+            del self.buckets[cnt]  # its counter is dropped lazily
+        return
+
+    def add(self, entry):
+        key = get_key(entry)
+        self.entries[key] = entry
+        self.bucket_add(key, entry, entry.counter)
+        return
+
+    def remove(self, entry):
+        key = get_key(entry)
+        if self.entries.get(key) is entry:
+            del self.entries[key]
+            self.bucket_remove(key)
+        return
+
+    def hit(self, entry):
+        key = get_key(entry)
+        if self.entries.get(key) is entry:
+            self.bucket_remove(key)
+            self.bucket_add(key, entry, entry.counter)
+        return
+
+    def evict(self, num):
+        victims = []
+        while self.entries and len(victims) < num:
+            while self.counters[0] not in self.buckets:
+                heappop(self.counters)
+            bucket = self.buckets[self.counters[0]]
+            (key, entry) = next(iter(bucket.items()))
+            self.remove(entry)
+            victims.append(entry)
+        return victims
+
+
+if __name__ == '__main__':
+    import element
+
+    def new_entry(i, ts):
+        return element.Entry(setting.FIELD_DSTIP, 32, i, [(setting.ACT_FWD, 1)],
+                             ts=ts, timeout=10, timeout_type=setting.TIMEOUT_IDLE)
+
+    e = Evictor()
+    entries = [new_entry(i, i) for i in range(5)]
+    for entry in entries:
+        e.add(entry)
+    entries[0].ts = 7  # idle refresh
+    e.remove(entries[3])
+    assert [v.match_field for v in e.evict(3)] == [1, 2, 4]
+    assert [v.match_field for v in e.evict(3)] == [0]
+
+    e = Evictor()  # churn without overflow keeps the heap bounded
+    entries = [None]*10
+    for i in range(10000):
+        if entries[i % 10] is not None:
+            e.remove(entries[i % 10])
+        entries[i % 10] = new_entry(i, i)
+        e.add(entries[i % 10])
+    assert len(e.entries) == 10 and len(e.heap) <= 2*10+64+1
+    assert [v.match_field for v in e.evict(10)] == list(range(9990, 10000))
+
+    e = LRUEvictor()
+    entries = [new_entry(i, 0) for i in range(5)]
+    for entry in entries:
+        e.add(entry)
+    e.hit(entries[0])
+    e.hit(entries[2])
+    e.remove(entries[1])
+    assert [v.match_field for v in e.evict(3)] == [3, 4, 0]
+
+    e = LFUEvictor()
+    entries = [new_entry(i, 0) for i in range(5)]
+    for entry in entries:
+        e.add(entry)
+    for (i, hits) in [(0, 3), (1, 1), (2, 2), (4, 1)]:
+        for _ in range(hits):
+            entries[i].counter += 1
+            e.hit(entries[i])
+    assert [v.match_field for v in e.evict(3)] == [3, 1, 4]
+    e.add(new_entry(5, 0))
+    assert [v.match_field for v in e.evict(3)] == [5, 2, 0]
+    assert len(e.evict(1)) == 0
@@ -9,6 +9,12 @@ import controller
 import setting
 
 
+def new_subnet_map():
+    # (old src subnet << 8 | old dst subnet) -> [new src, new dst], -1 if unset
+    import numpy
+    return numpy.full((1 << 16, 2), -1, dtype=numpy.int64)
+
+
 class Network:
     def __init__(self, topo, soft_labels=None, ruleset_pkl=None):
         self.topo = topo
@@ -37,6 +43,25 @@ class Network:
         self.traffic.add_pkts(pkts)
         return 0
     
+    def generate_random_columns(self, traffic_mat, total, burst_max=1, exp=1, 
+                                pktsize=1500, trace_file=None):
+        """generate_random_traffic in one batch into a ColumnarTraffic: 
+        (src, dst) pairs and burst sizes are drawn from alias tables by a 
+        RandomState seeded from random, so the result follows random.seed;
+        with trace_file, written to it in batches and memory-mapped
+        """
+        import numpy
+        from random import getrandbits
+        rng = numpy.random.RandomState(getrandbits(32))
+        cells = [p for row in traffic_mat for p in row]
+        pairs = element.alias_sample(element.alias_table(cells), total, rng)
+        (srcs, dsts) = numpy.divmod(pairs, len(traffic_mat[0]))
+        burst_table = element.alias_table(element.zipf_pdf(burst_max, exp))
+        bursts = element.alias_sample(burst_table, total, rng)+1
+        self.traffic = traffic.synflows2cols(srcs, dsts, bursts, pktsize, rng, 
+                                             trace_file)
+        return 0
+
     def generate_sample_traffic(self, dup=1):
         self.traffic = traffic.Traffic()
         pkts = []
@@ -48,21 +73,22 @@ class Network:
         return 0
 
     def traffic_mapping(self, old_pkts, sw_list=None):
+        return list(self.map_pkts(old_pkts, sw_list))
+
+    def map_pkts(self, old_pkts, sw_list=None):  # yield mapped packets one by one
         from random import randint, choice
         
         # *.*.sub.* -> *.*.dst.*
-        syn_pkts = []
         tp2tp = {}
         subnet2subnet = {}
         if sw_list is None:
             sw_list = range(self.switch_num)
 
+        others = {sub: [x for x in sw_list if x != sub] for sub in sw_list}
         for pkt in old_pkts:
             old_tp = pkt.tp
-            old_src_split = old_tp[0].split('.')
-            old_dst_split = old_tp[1].split('.')
-            old_src_sub = int(old_src_split[2])
-            old_dst_sub = int(old_dst_split[2])
+            old_src_sub = element.get_subnet(old_tp[0])
+            old_dst_sub = element.get_subnet(old_tp[1])
             
             new_tp = list(old_tp)
             new_src_sub = None
@@ -75,32 +101,81 @@ class Network:
                     (new_src_sub, new_dst_sub) = subnet2subnet[(old_src_sub, old_dst_sub)]
                 else:
                     new_src_sub = choice(sw_list)
-                    new_dst_sub = choice(filter(lambda x:x!=new_src_sub, sw_list))
+                    new_dst_sub = choice(others[new_src_sub])
                     subnet2subnet[(old_src_sub, old_dst_sub)] = (new_src_sub, new_dst_sub)
-                new_tp[0] = '{}.{}.{}.{}'.format(old_src_split[0],
-                                                 old_src_split[1],
-                                                 new_src_sub,
-                                                 old_src_split[3])
-                new_tp[1] = '{}.{}.{}.{}'.format(old_dst_split[0],
-                                                 old_dst_split[1],
-                                                 new_dst_sub,
-                                                 old_dst_split[3])
+                new_tp[0] = (old_tp[0] & 0xffff00ff) | (new_src_sub << 8)
+                new_tp[1] = (old_tp[1] & 0xffff00ff) | (new_dst_sub << 8)
                 new_tp = tuple(new_tp)
                 tp2tp[old_tp] = new_tp
             
-            syn_pkts.append(traffic.Packet(new_tp, pkt.size))
+            yield traffic.Packet(new_tp, pkt.size)
         
         # for t in tp2tp: print('%s:%s' % (t, tp2tp[t]))
         # for n in subnet2subnet: print('%s:%s' % ((element.int2ip(n[0]), element.int2ip(n[1])), subnet2subnet[n]))
-        return syn_pkts
 
-    def generate_real_traffic(self, filename, sw_list=None):  # sw_list: senders 
-        # real pcap/pkl -> syn traffic 
+    def map_columns(self, old_traffic, sw_list=None, subnet_map=None):
+        """traffic_mapping over a ColumnarTraffic, as integer operations on 
+        the third octet: subnet_map (see new_subnet_map) is the lookup array
+        of subnet pairs, filled in place; new pairs are drawn in the same 
+        order as map_pkts, so the mapped traffic is the same for the same 
+        random state. Saved with numpy.save, a map remaps later traces alike
+        """
+        import numpy
+        from random import choice
+
+        if sw_list is None:
+            sw_list = range(self.switch_num)
+        if subnet_map is None:
+            subnet_map = new_subnet_map()
+        cols = numpy.array(old_traffic.cols)
+        if len(cols) == 0:
+            return traffic.ColumnarTraffic()
+
+        # subnet pair of each flow, drawn in order of first appearance
+        flows = old_traffic.tps
+        if isinstance(flows, list):
+            flows = numpy.zeros(len(flows), dtype=traffic.trace_dtypes()[1][1])
+            for (j, name) in enumerate(traffic.FLOW_FIELDS):
+                flows[name] = [tp[j] for tp in old_traffic.tps]
+        else:
+            flows = numpy.array(flows)
+        pair = (flows['srcip'] & 0xff00) | ((flows['dstip'] >> 8) & 0xff)
+        (pairs, first, inverse) = numpy.unique(pair, return_index=True, 
+                                               return_inverse=True)
+        others = {sub: [x for x in sw_list if x != sub] for sub in sw_list}
+        for i in numpy.argsort(first, kind='mergesort').tolist():
+            if subnet_map[pairs[i]][0] < 0:
+                new_src_sub = choice(sw_list)
+                subnet_map[pairs[i]] = (new_src_sub, choice(others[new_src_sub]))
+        new_src = subnet_map[pairs, 0][inverse]
+        new_dst = subnet_map[pairs, 1][inverse]
+        flows['srcip'] = (flows['srcip'] & 0xffff00ff) | (new_src << 8)
+        flows['dstip'] = (flows['dstip'] & 0xffff00ff) | (new_dst << 8)
+
+        flow = cols['flow']
+        cols['srcip'] = flows['srcip'][flow]
+        cols['dstip'] = flows['dstip'][flow]
+        cols['src'] = new_src[flow]
+        cols['dst'] = new_dst[flow]
+        cols['ts'] = numpy.nan  # as map_pkts, which drops timestamps
+        if traffic.has_repeat(flows):  # distinct flows collided; re-intern
+            t = traffic.ColumnarTraffic()
+            t.add_cols(cols)
+            return t
+        return traffic.ColumnarTraffic(cols, flows)
+
+    def generate_real_traffic(self, filename, sw_list=None, subnet_map=None):
+        # real pcap/pkl/trace -> syn traffic; sw_list: senders; subnet_map: 
+        # see map_columns, for traces
         self.traffic = traffic.Traffic()
         if filename.find('.pcap') != -1:
             real_traffic = traffic.Traffic(filename)
         elif filename.find('.pkl') != -1:
-            real_traffic = element.de_serialize(filename)
+            real_traffic = traffic.load_traffic(filename)
+        elif filename.endswith(setting.TRACE_EXT):
+            self.traffic = self.map_columns(traffic.load_trace(filename), sw_list,
+                                            subnet_map)
+            return
         else:
             raise NameError('Error. Not a valid input file format. Return')
             return
@@ -109,8 +184,8 @@ class Network:
         self.traffic.add_pkts(syn_pkts)
         return
 
-    def generate_log_traffic(self, pkl_file):  # traffic pkl -> traffic
-        self.traffic = element.de_serialize(pkl_file)
+    def generate_log_traffic(self, pkl_file):  # traffic pkl or trace -> traffic
+        self.traffic = traffic.load_traffic(pkl_file)
         return 
 
     # network modular is responsible for some control functions of controller
@@ -169,3 +244,26 @@ if __name__ == '__main__':
 
     n.generate_real_traffic('sample.pcap', soft_labels)
     n.traffic.print_traffic()
+
+    import random
+    ct = traffic.ColumnarTraffic()
+    ct.add_pkts(traffic.iter_pcap('sample.pcap'))
+    random.seed(1)
+    mapped = n.map_columns(ct, soft_labels)
+    random.seed(1)
+    t = traffic.Traffic()
+    t.add_pkts(n.traffic_mapping(traffic.pcap2pkts('sample.pcap'), soft_labels))
+    assert mapped.flownum.tolist() == t.flownum and mapped.flowsize == t.flowsize
+    for ((p1, _, _), p2) in zip(mapped.stream(), t.pkts):
+        assert (p1.tp, p1.src, p1.dst) == (p2.tp, p2.src, p2.dst)
+    subnet_map = new_subnet_map()
+    n.map_columns(ct, soft_labels, subnet_map)
+    again = n.map_columns(ct, soft_labels, subnet_map.copy())
+    assert again.get_tps() == n.map_columns(ct, soft_labels, subnet_map).get_tps()
+
+    random.seed(3)
+    n.generate_random_columns(setting.BRIDGE_TRAFFIC_MAT, 1000, 10)
+    assert n.traffic.flownum[-1] == 1000
+    pairs = set((p.src, p.dst) for (p, _, _) in n.traffic.stream())
+    assert all(setting.BRIDGE_TRAFFIC_MAT[s][d] > 0 for (s, d) in pairs)
+    assert all(element.get_subnet(p.srcip) == p.src for (p, _, _) in n.traffic.stream())
@@ -8,25 +8,72 @@ import network
 import ruleset
 
 
-def pre_pcap(pcap_filelist, pkl_file, max_flownum=None, json_file=None):
+def parse_pcap(pcap_file):  # one pcap into columns (a pool worker)
+    t = traffic.ColumnarTraffic()
+    t.add_pcap(pcap_file)
+    return t
+
+
+def pre_pcap(pcap_filelist, pkl_file, max_flownum=None, json_file=None, 
+             processes=None):
+    # pcaps are parsed by a pool of processes (all cores by default) and 
+    # merged in order, stopping after the file exceeding max_flownum
+    from multiprocessing import Pool
     print('serialize {} into {}'.format(pcap_filelist, pkl_file))
-    t = traffic.Traffic()
-    for pcap_file in pcap_filelist:
-        print('processing {}...'.format(pcap_file))
-        pkts = traffic.pcap2pkts(pcap_file)
-        t.add_pkts(pkts)
-        flownum = t.flownum[-1]
-        print('flow number: {}'.format(flownum))
-        if max_flownum is not None and flownum > max_flownum:
-            break
-    t.serialize(pkl_file)
-    print('target flow number: {}; real flow number: {}'.format(max_flownum, t.flownum[-1]))
-    print('total number of packets: {}'.format(len(t.pkts)))
+    pool = None
+    if processes != 1 and len(pcap_filelist) > 1:
+        pool = Pool(processes, maxtasksperchild=1)
+        parts = pool.imap(parse_pcap, pcap_filelist)
+    else:
+        parts = (parse_pcap(pcap_file) for pcap_file in pcap_filelist)
+    t = traffic.ColumnarTraffic()
+    try:
+        for (i, part) in enumerate(parts):
+            print('processing {}...'.format(pcap_filelist[i]))
+            t.extend(part)
+            flownum = len(t.tps)
+            print('flow number: {}'.format(flownum))
+            if max_flownum is not None and flownum > max_flownum:
+                break
+    finally:
+        if pool is not None:  # files past the cutoff are not needed
+            pool.terminate()
+            pool.join()
+    t.to_traffic().serialize(pkl_file)
+    print('target flow number: {}; real flow number: {}'.format(max_flownum, len(t.tps)))
+    print('total number of packets: {}'.format(t.get_size()))
     if json_file is not None:
         t.print_traffic_data(json_file)
     return
 
 
+def remap_traffic(n, in_file, out_file, map_file, sw_list=None):
+    # in_file, a trace or a traffic pkl (first converted into a trace next 
+    # to it), is remapped in one pass with the subnet map in map_file 
+    # (reused if present, see Network.map_columns). A trace is saved as a 
+    # trace, a pkl as out_file; returns the file written
+    import os
+    import numpy
+    trace_file = in_file
+    if in_file.endswith('.pkl'):
+        trace_file = os.path.splitext(in_file)[0]+setting.TRACE_EXT
+        print('convert {} into {}'.format(in_file, trace_file))
+        traffic.pkl2trace(in_file, trace_file)
+    elif not in_file.endswith(setting.TRACE_EXT):
+        raise NameError('Error. Only a trace or pkl can be remapped. Exit.')
+    if os.path.exists(map_file):
+        subnet_map = numpy.load(map_file)
+    else:
+        subnet_map = network.new_subnet_map()
+    n.generate_real_traffic(trace_file, sw_list, subnet_map)
+    numpy.save(map_file, subnet_map)
+    if in_file.endswith('.pkl'):
+        n.traffic.to_traffic().serialize(out_file)
+    else:
+        out_file = os.path.splitext(out_file)[0]+setting.TRACE_EXT
+        n.traffic.save_trace(out_file)
+    return out_file
+
 
 def pre_single(pkl_file):
     print('single: transform {} into {}'.format(pkl_file, setting.SINGLE_TRAFFIC_LOGFILE))
@@ -35,8 +82,8 @@ def pre_single(pkl_file):
     sw_list = setting.SINGLE_SW_LIST
 
     n = network.Network(topo)
-    n.generate_real_traffic(pkl_file, sw_list)
-    n.traffic.serialize(setting.SINGLE_TRAFFIC_LOGFILE)
+    remap_traffic(n, pkl_file, setting.SINGLE_TRAFFIC_LOGFILE, 
+                  setting.SINGLE_SUBNET_MAP, sw_list)
     n.traffic.print_traffic_data(setting.SINGLE_TRAFFIC_DATA)
 
     print('flow number: {}'.format(n.traffic.flownum[-1]))
@@ -105,8 +152,8 @@ def pre_classbench_trace():
         tf = traffic.Traffic()
         pkts = []
         for l in lines:
-            srcip = element.int2ip(int(l[0]))
-            dstip = element.int2ip(int(l[1]))
+            srcip = int(l[0])
+            dstip = int(l[1])
             srcport = int(l[2])
             dstport = int(l[3])
             protocol = int(l[4])
@@ -121,6 +168,16 @@ def pre_classbench_trace():
     return
 
 
+def pre_trace(pkl_filelist):
+    # pickled traffic -> columnar trace files next to them
+    from os.path import splitext
+    for pkl_file in pkl_filelist:
+        trace_file = splitext(pkl_file)[0]+setting.TRACE_EXT
+        print('convert {} into {}'.format(pkl_file, trace_file))
+        traffic.pkl2trace(pkl_file, trace_file)
+    return
+
+
 def pre_brain(pkl_file):
     print('generating brain rule and trace...')
 
@@ -129,15 +186,14 @@ def pre_brain(pkl_file):
     topo = setting.BRAIN
 
     n = network.Network(topo)
-    n.generate_real_traffic(pkl_file)
-    n.traffic.serialize(setting.BRAIN_TRAFFIC_LOGFILE)
+    traffic_pkl = remap_traffic(n, pkl_file, setting.BRAIN_TRAFFIC_LOGFILE, 
+                                setting.BRAIN_SUBNET_MAP)
     n.traffic.print_traffic_data(setting.BRAIN_TRAFFIC_DATA)
 
     print('flow number: {}'.format(n.traffic.flownum[-1]))
 
     print('brain: generating rule set...')
 
-    traffic_pkl = setting.BRAIN_TRAFFIC_LOGFILE
     ruleset_pkl = setting.BRAIN_RULE_PKL
     rs = ruleset.Ruleset()
     rs.generate_ruleset_from_traffic(traffic_pkl, 24, 0.5)
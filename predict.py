@@ -53,6 +53,12 @@ class Predictor:
     def predict(self, key, curtime=None):
         return setting.DEFAULT_TIMEOUT
 
+    def get_state(self):  # picklable state for simulation snapshots
+        return self.__dict__.copy()
+
+    def set_state(self, state):
+        self.__dict__.update(state)
+
     def round(self, value):
         # round to 1s
         return int(value / 1e6 + 0.5) * 1e6
@@ -292,6 +298,17 @@ class DQNPredictor(Predictor):
             raise NameError('Error. No such info type. Exit.')
         return
 
+    def get_state(self):  # the model is kept as its weights
+        state = self.__dict__.copy()
+        state['model'] = self.model.get_weights()
+        return state
+
+    def set_state(self, state):  # after init, which builds the model
+        model = self.model
+        self.__dict__.update(state)
+        self.model = model
+        self.model.set_weights(state['model'])
+
     def predict_states(self, states):
         return self.model.predict(states)
 
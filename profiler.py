@@ -0,0 +1,121 @@
+#  implement opt-in phase timing for simulate
+
+
+from __future__ import print_function
+from time import time
+import json
+
+
+PHASES = [('Switch.update', 'switches', 'update'),
+          ('Switch.recv_pkt', 'switches', 'recv_pkt'),
+          ('Controller.packet_in', 'controller', 'packet_in'),
+          ('Controller.flow_removed', 'controller', 'flow_removed'),
+          ('Network.process_ctrl_messages', 'net', 'process_ctrl_messages'),
+          ('predictor.train', 'predictor', 'train'),
+          ('predictor.predict', 'predictor', 'predict'),
+          ('Data.record_fct', 'data', 'record_fct')]
+
+
+def attach(para, d):
+    # a Profiler hooked into the objects of para['net'] and d, or None
+    if 'profile' not in para or not para['profile']:
+        return None
+    n = para['net']
+    objs = {'switches': n.switches, 'controller': [n.controller], 'net': [n],
+            'predictor': [n.controller.predictor], 'data': [d]}
+    prof = Profiler()
+    for (name, kind, method) in PHASES:
+        for obj in objs[kind]:
+            if obj is not None and hasattr(obj, method):
+                prof.wrap(name, obj, method)
+    return prof
+
+
+class Profiler:
+    """Cumulative wall time and call count of each phase, measured by
+    wrapping the bound methods of the simulated instances. Nothing is wrapped
+    unless profiling is enabled, so the default run is untouched. Times are
+    inclusive (e.g. Controller.packet_in contains predictor.predict).
+    """
+    def __init__(self):
+        self.start = time()
+        self.phases = {}  # name -> [calls, seconds]
+        self.rate = {'time': [], 'pktnum': [], 'pps': []}
+        self.last = (self.start, 0)
+        self.wrapped = []  # (obj, method, wrapper)
+
+    def wrap(self, name, obj, method):
+        func = getattr(obj, method)
+        if name not in self.phases:
+            self.phases[name] = [0, 0.0]
+        stat = self.phases[name]
+
+        def timed(*args, **kwargs):
+            t = time()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                stat[0] += 1
+                stat[1] += time()-t
+
+        setattr(obj, method, timed)  # shadows the class method
+        self.wrapped.append((obj, method, timed))
+        return
+
+    def detach(self):  # e.g. before pickling the wrapped objects
+        for (obj, method, _) in self.wrapped:
+            delattr(obj, method)
+        return
+
+    def reattach(self):
+        for (obj, method, timed) in self.wrapped:
+            setattr(obj, method, timed)
+        return
+
+    def record(self, pktnum):  # packets per second since the last record
+        now = time()
+        (last_time, last_pktnum) = self.last
+        pps = 0.0
+        if now > last_time:
+            pps = (pktnum-last_pktnum)/(now-last_time)
+        self.rate['time'].append(now-self.start)
+        self.rate['pktnum'].append(pktnum)
+        self.rate['pps'].append(pps)
+        self.last = (now, pktnum)
+        return
+
+    def get_profile(self):
+        phases = {name: {'calls': self.phases[name][0],
+                         'time': self.phases[name][1]}
+                  for name in self.phases}
+        return {'total': time()-self.start, 'phases': phases, 'rate': self.rate}
+
+    def print_profile(self, filename):
+        with open(filename, 'w') as f:
+            print(json.dumps(self.get_profile()), file=f)
+        return
+
+
+if __name__ == '__main__':
+    class Dummy:
+        def work(self, x):
+            return x+1
+
+    prof = Profiler()
+    a = Dummy()
+    b = Dummy()
+    prof.wrap('Dummy.work', a, 'work')
+    prof.wrap('Dummy.work', b, 'work')
+    assert a.work(1) == 2 and b.work(2) == 3 and a.work(3) == 4
+    assert Dummy().work(0) == 1
+    p = prof.get_profile()
+    assert p['phases']['Dummy.work']['calls'] == 3
+    prof.detach()
+    assert 'work' not in a.__dict__ and a.work(0) == 1
+    prof.reattach()
+    assert a.work(0) == 1
+    assert prof.get_profile()['phases']['Dummy.work']['calls'] == 4
+    prof.record(100)
+    prof.record(300)
+    assert prof.rate['pktnum'] == [100, 300]
+    assert attach({}, None) is None
@@ -2,7 +2,7 @@
 
 
 from __future__ import print_function
-import element, setting
+import element, setting, traffic
 
 
 """generate exact and wildcard matching rules based on dst IP
@@ -12,31 +12,179 @@ class Ruleset:
         self.rules = {}
         self.ruleset = set()
         self.depset = {}
+        self.maxdep = setting.INF
+        self.index = None  # see build_index
+        self.fallback = set()  # exact rules of destinations nothing matched
+
+    def __getstate__(self):  # the index is rebuilt on demand
+        state = self.__dict__.copy()
+        state['index'] = None
+        return state
+
+    def __setstate__(self, state):  # also restores pickles without an index
+        self.__dict__.update(state)
+        self.__dict__.setdefault('maxdep', setting.INF)
+        self.__dict__.setdefault('index', None)
+        self.__dict__.setdefault('fallback', set())
+
+    def normalize_addr(self):
+        # upgrade rule sets pickled with dotted-quad addresses in place
+        if len(self.ruleset) == 0 or not isinstance(next(iter(self.ruleset))[1], str):
+            return
+        rule2int = lambda r: (r[0], element.ip2int(r[1]))
+        self.rules = {element.ip2int(ip): rule2int(self.rules[ip]) for ip in self.rules}
+        self.ruleset = set(rule2int(r) for r in self.ruleset)
+        self.depset = {rule2int(r): [rule2int(d) for d in self.depset[r]] 
+                       for r in self.depset}
+        self.fallback = set(rule2int(r) for r in self.fallback)
+        self.index = None
+        return
+
+    def build_index(self):
+        # rules sorted by range start and keyed by (mask, range start); 
+        # destinations sorted and grouped by rule
+        ranges = sorted((element.get_ip_range(r[1], r[0])[0], r) for r in self.ruleset)
+        prefixes = {}
+        for (ipmin, r) in ranges:
+            prefixes.setdefault((r[0], ipmin), []).append(r)
+        users = {}
+        for dstip in self.rules:
+            users.setdefault(self.rules[dstip], set()).add(dstip)
+        self.index = {'ranges': ranges, 'prefixes': prefixes, 
+                      'dstips': sorted(self.rules), 'users': users}
+        return
+
+    def get_nested(self, rule):
+        # prefixes either nest or are disjoint, so the rules overlapping rule 
+        # with masks no shorter start within its range: a contiguous run of 
+        # the index, in order of range start
+        from bisect import bisect_left
+        (ipmin, ipmax) = element.get_ip_range(rule[1], rule[0])
+        ranges = self.index['ranges']
+        return [r for (_, r) in 
+                ranges[bisect_left(ranges, (ipmin,)):bisect_left(ranges, (ipmax+1,))]
+                if r[0] >= rule[0] and r != rule]
+
+    def get_covering(self, rule):  # rules with masks no longer containing rule
+        ipmin = element.get_ip_range(rule[1], rule[0])[0]
+        prefixes = self.index['prefixes']
+        return [r for mask in range(rule[0]+1) 
+                for r in prefixes.get((mask, element.get_prefix(ipmin, mask)), [])]
 
     def get_depset(self, maxdep):
+        # dependencies are listed in set order, up to maxdep+1 of them
+        from heapq import nsmallest
+        self.maxdep = maxdep
+        self.build_index()
+        order = {r: i for (i, r) in enumerate(self.ruleset)}
         for ri in self.ruleset:
             self.depset[ri] = []
             if ri[0] == 32: continue
-            ri_range = element.get_ip_range(ri[1], ri[0])
-            for rj in self.ruleset:
-                if rj[0] < ri[0] or rj == ri: continue
-                rj_range = element.get_ip_range(rj[1], rj[0])
-                if ri_range[1] < rj_range[0] or rj_range[1] < ri_range[0]:
-                    continue
-                else:
-                    self.depset[ri].append(rj)
-                    if len(self.depset[ri]) > maxdep:
-                        break
+            deps = self.get_nested(ri)
+            if len(deps) > maxdep:
+                deps = nsmallest(int(maxdep)+1, deps, key=order.get)
+            else:
+                deps.sort(key=order.get)
+            self.depset[ri] = deps
+        return
+
+    def insert_rule(self, rule):  # into ruleset, index and depset only
+        from bisect import insort
+        ipmin = element.get_ip_range(rule[1], rule[0])[0]
+        self.ruleset.add(rule)
+        insort(self.index['ranges'], (ipmin, rule))
+        self.index['prefixes'].setdefault((rule[0], ipmin), []).append(rule)
+        deps = []
+        if rule[0] < 32:
+            deps = self.get_nested(rule)
+            if len(deps) > self.maxdep:
+                deps = deps[:int(self.maxdep)+1]
+        self.depset[rule] = deps
+        for r in self.get_covering(rule):
+            if r[0] < 32 and r != rule and len(self.depset[r]) <= self.maxdep:
+                self.depset[r].append(rule)
+        return
+
+    def add_rule(self, rule):
+        """Adds rule, (mask, prefix), updating the dependencies of the rules 
+        it overlaps; destinations it now matches longest are mapped to it, 
+        and fallback rules under it are removed, their destinations taken 
+        over. New dependencies are listed after the existing ones.
+        """
+        from bisect import bisect_left, bisect_right
+        if rule in self.ruleset:
+            self.fallback.discard(rule)  # now a rule in its own right
+            return
+        if self.index is None:
+            self.build_index()
+        self.insert_rule(rule)
+
+        (ipmin, ipmax) = element.get_ip_range(rule[1], rule[0])
+        (dstips, users) = (self.index['dstips'], self.index['users'])
+        for dstip in dstips[bisect_left(dstips, ipmin):bisect_right(dstips, ipmax)]:
+            old = self.rules[dstip]
+            if old[0] < rule[0]:
+                self.rules[dstip] = rule
+                users[old].discard(dstip)
+                users.setdefault(rule, set()).add(dstip)
+        for r in self.get_nested(rule):
+            if r in self.fallback:
+                self.remove_rule(r)  # its destination falls back to rule
+        return
+
+    def remove_rule(self, rule):
+        """Removes rule, updating the dependencies of the rules it overlaps; 
+        its destinations fall back to the longest remaining match, or to a 
+        new exact rule of their own.
+        """
+        from bisect import bisect_left
+        if rule not in self.ruleset:
+            return
+        if self.index is None:
+            self.build_index()
+        self.fallback.discard(rule)
+        ipmin = element.get_ip_range(rule[1], rule[0])[0]
+        self.ruleset.remove(rule)
+        ranges = self.index['ranges']
+        del ranges[bisect_left(ranges, (ipmin, rule))]
+        prefixes = self.index['prefixes']
+        prefixes[(rule[0], ipmin)].remove(rule)
+        if len(prefixes[(rule[0], ipmin)]) == 0:
+            del prefixes[(rule[0], ipmin)]
+        self.depset.pop(rule, None)
+        for r in self.get_covering(rule):
+            deps = self.depset[r]
+            if rule not in deps: continue
+            capped = len(deps) > self.maxdep
+            deps.remove(rule)
+            if capped:  # refill up to the cap
+                listed = set(deps)
+                for d in self.get_nested(r):
+                    if len(deps) > self.maxdep: break
+                    if d not in listed:
+                        deps.append(d)
+
+        users = self.index['users']
+        for dstip in sorted(users.pop(rule, ())):
+            covering = self.get_covering((32, dstip))
+            if len(covering) > 0:
+                new_rule = covering[-1]  # the longest mask comes last
+            else:
+                new_rule = (32, dstip)
+                self.insert_rule(new_rule)
+                self.fallback.add(new_rule)
+            self.rules[dstip] = new_rule
+            users.setdefault(new_rule, set()).add(dstip)
         return
 
     def generate_ruleset_from_traffic(self, traffic_pkl, mask=24, rate=0, maxdep=setting.INF):
-        traffic = element.de_serialize(traffic_pkl)
+        t = traffic.load_traffic(traffic_pkl)
         from random import random
-        for pkt in traffic.pkts:
+        for (pkt, _, _) in t.stream():
             if pkt.dstip in self.rules: continue
             dice = random()
             if dice <= rate:
-                dstprefix = element.int2ip(element.get_ip_range(pkt.dstip, mask)[0])
+                dstprefix = element.get_prefix(pkt.dstip, mask)
                 self.rules[pkt.dstip] = (24, dstprefix)
                 self.ruleset.add((24, dstprefix))
             else:
@@ -50,10 +198,10 @@ class Ruleset:
     def generate_ruleset_from_classbench(self, classbench_rule, classbench_trace, 
                                          maxdep=setting.INF, minpri=0):
         with open(classbench_rule, 'r') as f:
-            lines = f.readlines()
-            lines = [l.rstrip('\n').split('\t') for l in lines]
-            for l in lines:
-                [dstip, priority_str] = l[1].split('/')
+            for line in f:
+                l = line.rstrip('\n').split('\t')
+                [dstip_str, priority_str] = l[1].split('/')
+                dstip = element.ip2int(dstip_str)
                 priority = int(priority_str)
                 # remove rules with very low priority
                 if priority < minpri:
@@ -61,22 +209,27 @@ class Ruleset:
                 else:   
                     self.ruleset.add((priority, dstip))
 
-        with open(classbench_trace, 'r') as f:
-            lines = f.readlines()
-            lines = [l.rstrip('\n').split('\t') for l in lines]
-            for l in lines:
-                dstip_int = int(l[1])
-                dstip = element.int2ip(dstip_int)
-                all_dstprefix = {mask: element.int2ip(element.get_ip_range(dstip, mask)[0])
-                                 for mask in range(33)}
-                for mask in range(32, minpri-1, -1):
-                    if (mask, all_dstprefix[mask]) in self.ruleset:
-                        self.rules[dstip] = (mask, all_dstprefix[mask])
-                        break
+        # longest matching rule of at least minpri bits, by one trie walk
+        trie = element.new_prefix_trie()
+        for (mask, prefix) in self.ruleset:
+            if mask >= minpri and element.get_prefix(prefix, mask) == prefix:
+                element.prefix_trie_add(trie, prefix, mask)
 
+        resolved = set()  # a destination always resolves to the same rule,
+                          # so the /32s added below need no trie entry
+        with open(classbench_trace, 'r') as f:
+            for line in f:
+                dstip = int(line.split('\t', 2)[1])
+                if dstip in resolved: continue
+                resolved.add(dstip)
+                mask = element.prefix_trie_match(trie, dstip)
+                if mask is not None:
+                    self.rules[dstip] = (mask, element.get_prefix(dstip, mask))
                 # fail to match
-                if dstip not in self.rules:
+                else:
                     self.rules[dstip] = (32, dstip)
+                    if (32, dstip) not in self.ruleset:
+                        self.fallback.add((32, dstip))
                     self.ruleset.add((32, dstip))
 
         self.get_depset(maxdep)
@@ -99,3 +252,30 @@ if __name__ == '__main__':
     print(rs.ruleset)
     print(rs.depset)
 
+    # against pairwise range checks
+    for maxdep in (len(rs.ruleset), 2):
+        rs.get_depset(maxdep)
+        for ri in rs.ruleset:
+            (ipmin, ipmax) = element.get_ip_range(ri[1], ri[0])
+            deps = [rj for rj in rs.ruleset if ri[0] < 32 and rj[0] >= ri[0] and 
+                    rj != ri and ipmin <= element.get_ip_range(rj[1], rj[0])[0] <= ipmax]
+            assert rs.depset[ri] == deps[:maxdep+1]
+
+
+    # incremental updates against a rebuild
+    rs.get_depset(setting.INF)
+    (old_rules, old_depset) = (dict(rs.rules), {r: set(rs.depset[r]) for r in rs.depset})
+    old_fallback = set(rs.fallback)
+    dstip = min(d for d in rs.rules if rs.rules[d] in rs.fallback)
+    rule = (30, element.get_prefix(dstip, 30))
+    assert rule not in rs.ruleset
+    rs.add_rule(rule)
+    assert rs.rules[dstip] == rule
+    assert not [r for r in rs.fallback if r[1] >> 2 == rule[1] >> 2]
+    ref = Ruleset()
+    ref.ruleset = set(rs.ruleset)
+    ref.get_depset(setting.INF)
+    assert {r: set(rs.depset[r]) for r in rs.depset} == {r: set(ref.depset[r]) for r in ref.depset}
+    rs.remove_rule(rule)
+    assert rs.rules == old_rules and rs.fallback == old_fallback
+    assert {r: set(rs.depset[r]) for r in rs.depset} == old_depset
@@ -20,6 +20,9 @@ FIELD_TP = -2001
 FIELD_DSTPREFIX = {
     mask: -2002-mask for mask in range(32)
 }
+DSTPREFIX_MASK = {
+    FIELD_DSTPREFIX[mask]: mask for mask in FIELD_DSTPREFIX
+}
  
 INST_ADD = -3000
 INST_DELETE = -3001
@@ -48,6 +51,15 @@ INFO_PACKET_IN = -7000
 INFO_FLOW_REMOVED = -7001
 INFO_TABLE_SIZE = -7002
 
+EVICT_FIFO = -8000
+EVICT_LRU = -8001
+EVICT_LFU = -8002
+
+EVENT_EXPIRE = 0  # events at the same time fire in this order
+EVENT_RESPONSE = 1
+EVENT_ARRIVAL = 2
+EVENT_TICK = 3
+
 """
 Numerical settings
 """
@@ -77,6 +89,17 @@ Q_MINT = 1e6
 Q_MIDT = 5e6
 Q_MAXT = 10e6
 
+"""Traffic settings
+Count-Min sketch of flow sizes for streamed traffic; packets per chunk of 
+the pcap parser and of columnar traffic streams; columnar trace file format
+"""
+SKETCH_WIDTH = 2**18
+SKETCH_DEPTH = 4
+PKT_CHUNK = 2**16
+TRACE_MAGIC = b'HQTRACE\n'
+TRACE_VERSION = 1
+TRACE_EXT = '.trace'
+
 """Switch settings
 flow table size and forwarding delays cite from:
 'OFLOPS: An Open Framework for OpenFlow Switch Evaluation.'
@@ -84,6 +107,8 @@ flow table size and forwarding delays cite from:
 """
 FLOW_TABLE_SIZE = {TYPE_HARDWARE: 3000, TYPE_SOFTWARE: 1e9}
 UNLIMITED_FLOW_TABLE = {TYPE_HARDWARE: INF, TYPE_SOFTWARE: INF}
+EVICT_POLICY = {TYPE_HARDWARE: EVICT_FIFO, TYPE_SOFTWARE: EVICT_FIFO}
+MICROFLOW_CACHE_SIZE = 65536  # insertions per switch before a flush; 0 disables
 LINK_RATE = 0.008  # us/B. 1Gbps link 
 HARDWARE_FWD_DELAY = 5  # 4~5 us. ProCurve 5406zl 
 SOFTWARE_FWD_DELAY = 35  # us. Open vSwitch
@@ -166,6 +191,7 @@ SINGLE_SW_LIST = [0, 2]
 SINGLE_TRAFFIC_LOGFILE = 'single.pkl'
 SINGLE_TRAFFIC_DATA = 'single.json'
 SINGLE_RULE_PKL = 'single_rule_0.2.pkl'
+SINGLE_SUBNET_MAP = 'single_map.npy'
 
 
 """germany50
@@ -468,6 +494,7 @@ for src in sw_list:
 BRAIN_TRAFFIC_LOGFILE = 'brain.pkl'
 BRAIN_TRAFFIC_DATA = 'brain.json'
 BRAIN_RULE_PKL = 'brain_rule.pkl'
+BRAIN_SUBNET_MAP = 'brain_map.npy'
 
 
 """Classbench constants
@@ -2,22 +2,238 @@
 
 
 from __future__ import print_function
+from itertools import islice
+import os
+import random
 import element
 import setting
 import network
 import data
+import event
+import traffic
+import profiler
     
 
+def check_point(para, d, fnum, curtime, overflow_num, pktin, pktnum, prof=None):
+    n = para['net']
+    c = n.controller
+    log_prefix = para['log_prefix']
+    validate_point = None
+    if 'validate_point' in para:
+        validate_point = para['validate_point']
+
+    instractions = [(setting.INST_QUERY, setting.INST_OBJ_ALL, None)]
+    ret = n.process_ctrl_messages(instractions)
+    totentry = ret[setting.INST_OBJ_ALL]
+    totinstall = 0
+    for entry in c.install_num:
+        totinstall += c.install_num[entry]
+    if validate_point is None:
+        d.record(fnum, curtime, totentry, overflow_num, pktin, totinstall, pktnum)
+    elif pktnum >= validate_point:
+        d.record(fnum, curtime, totentry, overflow_num, pktin, totinstall, pktnum)
+    
+    d.print_checkpoint(fnum, log_prefix+'_checkpoint.txt')
+    if prof is not None:
+        prof.record(pktnum)
+        prof.print_profile(log_prefix+'_profile.json')
+
+    if 'save_model' in para:
+        c.predictor.save_weights(log_prefix)
+    return
+
+
+def get_source(para):
+    # packets of the network's traffic, or streamed from para['pkt_source']
+    if 'pkt_source' in para:
+        flowsize = None
+        if 'flowsize' in para:
+            flowsize = para['flowsize']
+        return traffic.PacketStream(para['pkt_source'], flowsize)
+    return para['net'].traffic
+
+
+def save_snapshot(para, state, prof=None):
+    """state of the loop in simulate plus switch flow tables, install counts,
+    predictor and random state; written atomically, so 
+    <log_prefix>_snapshot.pkl always holds the latest complete snapshot.
+    Its size is bounded by the flow count and table sizes, not the packet 
+    count: about 3 MB and 0.35 s each for 100k flows
+    """
+    n = para['net']
+    c = n.controller
+    filename = para['log_prefix']+'_snapshot.pkl'
+    if prof is not None:  # wrappers are not picklable
+        prof.detach()
+    try:
+        snapshot = dict(state)
+        snapshot['switches'] = n.switches
+        snapshot['install_num'] = c.install_num
+        snapshot['predictor'] = c.predictor.get_state()
+        snapshot['random'] = random.getstate()
+        element.serialize(snapshot, filename+'.tmp')
+    finally:
+        if prof is not None:
+            prof.reattach()
+    os.rename(filename+'.tmp', filename)
+    return
+
+
+def load_snapshot(para):  # restore the network and controller; None if absent
+    n = para['net']
+    c = n.controller
+    filename = para['log_prefix']+'_snapshot.pkl'
+    if not os.path.exists(filename):
+        return None
+    snapshot = element.de_serialize(filename)
+    n.switches = snapshot['switches']
+    c.install_num = snapshot['install_num']
+    c.predictor.set_state(snapshot['predictor'])
+    random.setstate(snapshot['random'])
+    return snapshot
+
+
+def finish(para, d, source, prof=None):
+    c = para['net'].controller
+    log_prefix = para['log_prefix']
+
+    if isinstance(source, traffic.PacketStream) and source.sketch is not None:
+        d.split_fct(source.get_flowsize)
+
+    d.record_install_num(c.install_num)
+
+    d.print_data(log_prefix)
+    if prof is not None:
+        prof.print_profile(log_prefix+'_profile.json')
+
+    if 'save_model' in para:
+        c.predictor.save_model(log_prefix)
+    return
+
+
+def forward_pkt(n, pkt, curtime, mode):
+    # walk pkt hop by hop from its source; returns the number of overflows
+    c = n.controller
+    sw = n.switches[pkt.src]
+    # print('*arriving source s{}'.format(sw.label))
+    hop = 0
+    of = 0
+    pkt.path = 0
+    pkt.pktin = 0
+    while True:
+        pkt.path = c.extend_path(pkt.path, sw.label)
+        if pkt.dst == sw.label:
+            # print('*arriving destination s{}'.format(sw.label))
+            break
+
+        [expire, overflow] = sw.update(curtime)
+        of += len(overflow)
+        # print('*update\n**s{}'.format(sw.label))
+        # if len(expire) != 0:
+        #     print('**expire:')
+        #     for entry in expire: print(entry)
+        # if len(overflow) != 0:
+        #     print('**overflow:')
+        #     for entry in overflow: print(entry)
+
+        instractions = c.flow_removed(sw.label, expire, overflow, curtime, mode)
+        n.process_ctrl_messages(instractions)
+
+        [pkt, next_hop] = sw.recv_pkt(pkt, curtime)
+        # print('*forwarding to {}'.format(next_hop))
+        if next_hop == setting.CTRL:
+            pkt.pktin += 1
+            instractions = c.packet_in(sw.label, pkt, curtime, mode)
+            n.process_ctrl_messages(instractions)
+        else:
+            sw = n.switches[next_hop]
+        hop += 1
+        assert hop < 10*len(n.topo)
+    # print('*pkt path = {}'.format(c.get_path(pkt.path)))
+    return of
+
+
+def start_run(n, pkt):
+    """the fast-forward run of pkt's flow: its path and the installed rule 
+    it matches at each hop; None if some hop needs the controller. The run 
+    holds while these rules are still the matches of the flow, as found by 
+    Switch.lookup: one probe of the microflow cache, which is invalidated by
+    any table change that may alter them, or a classify if it is disabled
+    """
+    c = n.controller
+    sw = n.switches[pkt.src]
+    hops = []
+    pid = 0
+    while True:
+        pid = c.extend_path(pid, sw.label)
+        if pkt.dst == sw.label:
+            break
+
+        entry = sw.lookup(pkt)
+        if entry.action is None:
+            return None
+        next_hop = None
+        for (act_type, value) in entry.action:
+            if act_type == setting.ACT_FWD:
+                next_hop = value
+        if next_hop is None or next_hop == setting.CTRL:
+            return None
+        hops.append((sw, entry))
+        if len(hops) >= 10*len(n.topo):
+            return None
+        sw = n.switches[next_hop]
+
+    return {'path': pid, 'hops': hops, 'delay': {}, 
+            'hits': 0, 'ts': None, 'last': None}
+
+
+def fast_forward_pkt(n, pkt, run, curtime, mode, pending):
+    """forward pkt along run if its rules still match; returns [forwarded, 
+    overflow num]. A hop with an expiry due or an oversized table is updated
+    as in forward_pkt; if pkt is not forwarded it must go through 
+    forward_pkt, where repeating these updates is a no-op.
+    """
+    c = n.controller
+    of = 0
+    for (sw, entry) in run['hops']:
+        if sw.update_due(curtime):
+            flush_runs(pending)  # expiry and eviction read ts and counters
+            [expire, overflow] = sw.update(curtime)
+            of += len(overflow)
+            instractions = c.flow_removed(sw.label, expire, overflow, curtime, mode)
+            n.process_ctrl_messages(instractions)
+        if sw.lookup(pkt) is not entry:
+            return [False, of]
+    return [True, of]
+
+
+def flush_runs(pending):
+    """apply the deferred hits of fast-forwarded packets before anything 
+    reads them: counters, idle refreshes and eviction order come out as if
+    each packet had been forwarded, as runs are applied in the order of 
+    their last hits
+    """
+    for run in sorted(pending, key=lambda run: run['last']):
+        for (sw, entry) in run['hops']:
+            entry.counter += run['hits']
+            if (entry.ts is not None and 
+                entry.timeout_type == setting.TIMEOUT_IDLE):
+                entry.ts = run['ts']
+            sw.evictor.hit(entry)
+        run['hits'] = 0
+    del pending[:]
+    return
+
+
 def simulate(para):
+    if 'event_driven' in para and para['event_driven']:
+        return simulate_event(para)
+
     n = para['net']
     mode = para['mode']
-    log_prefix = para['log_prefix']
     check_interval = para['check_interval']
     predictor_name = para['predictor_name']
     update_interval = para['update_interval']
-    validate_point = None
-    if 'validate_point' in para:
-        validate_point = para['validate_point']
 
     c = n.controller
     c.add_predictor(predictor_name)
@@ -25,49 +241,69 @@ def simulate(para):
     n_units_updates = set()
     visited_check_points = set()
     
-    flownum = n.traffic.flownum
+    snapshot_interval = None
+    if 'snapshot_interval' in para:
+        snapshot_interval = para['snapshot_interval']
+
+    source = get_source(para)
     d = data.Data()
     curtime = 0
     overflow_num = 0
     pktnum = 0
     pktin = 0
+
+    if 'resume' in para and para['resume']:
+        snapshot = load_snapshot(para)
+        if snapshot is not None:
+            d = snapshot['data']
+            curtime = snapshot['curtime']
+            overflow_num = snapshot['overflow_num']
+            pktnum = snapshot['pktnum']
+            pktin = snapshot['pktin']
+            unit_updates = snapshot['unit_updates']
+            n_units_updates = snapshot['n_units_updates']
+            visited_check_points = snapshot['visited_check_points']
+
+    prof = profiler.attach(para, d)
+
+    fast_forward = 'fast_forward' in para and para['fast_forward']
+    runs = {}  # flow id -> fast-forward run of the flow, None if there is none yet
+    pending = []  # runs with deferred hits
     
-    for pkt in n.traffic.pkts:
+    # the packet cursor: packets before it are only replayed through the 
+    # source, which rebuilds its flow counts
+    for (pkt, fnum, flowsize) in islice(source.stream(), pktnum, None):
         # print('\nprocessing packet#{} {} at {}'.format(pktnum, pkt, curtime))
-        sw = n.switches[pkt.src]
-        # print('*arriving source s{}'.format(sw.label))
-        hop = 0
+        run = None
+        if fast_forward and pkt.flow in runs:
+            run = runs[pkt.flow]
+            if run is None:
+                run = start_run(n, pkt)
+                runs[pkt.flow] = run
+
+        forwarded = False
         of = 0
-        while True:
-            if pkt.dst == sw.label:
-                # print('*arriving destination s{}'.format(sw.label))
-                pkt.path.append(sw.label)
-                break
-
-            [expire, overflow] = sw.update(curtime)
-            of += len(overflow)
-            # print('*update\n**s{}'.format(sw.label))
-            # if len(expire) != 0:
-            #     print('**expire:')
-            #     for entry in expire: print(entry)
-            # if len(overflow) != 0:
-            #     print('**overflow:')
-            #     for entry in overflow: print(entry)
-
-            instractions = c.flow_removed(sw.label, expire, overflow, curtime, mode)
-            n.process_ctrl_messages(instractions)
-
-            [pkt, next_hop] = sw.recv_pkt(pkt, curtime)
-            # print('*forwarding to {}'.format(next_hop))
-            if next_hop == setting.CTRL:
-                pktin += 1
-                instractions = c.packet_in(sw.label, pkt, curtime, mode)
-                n.process_ctrl_messages(instractions)
-            else:
-                sw = n.switches[next_hop]
-            hop += 1
-            assert hop < 10*len(n.topo)
-        # print('*pkt path = {}'.format(pkt.path))
+        if run is not None:
+            [forwarded, of] = fast_forward_pkt(n, pkt, run, curtime, mode, pending)
+
+        if forwarded:  # hits on the rules of the run are deferred
+            if run['hits'] == 0:
+                pending.append(run)
+            run['hits'] += 1
+            run['ts'] = curtime
+            run['last'] = pktnum
+            pkt.path = run['path']
+            pkt.pktin = 0
+            if pkt.size not in run['delay']:
+                run['delay'][pkt.size] = c.get_path_delay(pkt.path, 0, pkt.size)
+            pkttime = run['delay'][pkt.size]
+        else:
+            flush_runs(pending)
+            of += forward_pkt(n, pkt, curtime, mode)
+            pktin += pkt.pktin
+            pkttime = c.get_path_delay(pkt.path, pkt.pktin, pkt.size)
+            if fast_forward:
+                runs[pkt.flow] = None  # rebuilt by its next packet
 
         if predictor_name == setting.PREDICTOR_SIMPLE:
             curtime_s = int(curtime/1e6)*1e6
@@ -94,43 +330,175 @@ def simulate(para):
                 unit_updates.add(curtime_s)
                 c.predictor.train()
 
-        fnum = flownum[pktnum]
         pktnum += 1
         overflow_num += of
-        pkttime = c.get_delay(pkt.path, pkt.size)
         curtime += pkttime
 
-        flowsize = n.traffic.flowsize[pkt.tp]
-        d.record_fct(pkt.tp, pkttime, flowsize)
+        d.record_fct(pkt.flow, pkttime, flowsize)
                 
         if fnum%check_interval == 0:
             # if fnum not in d.delay['flownum']:
             if fnum not in visited_check_points:
                 visited_check_points.add(fnum)
-                instractions = [(setting.INST_QUERY, setting.INST_OBJ_ALL, None)]
-                ret = n.process_ctrl_messages(instractions)
-                totentry = ret[setting.INST_OBJ_ALL]
-                totinstall = 0
-                for entry in c.install_num:
-                    totinstall += c.install_num[entry]
-                if validate_point is None:
-                    d.record(fnum, curtime, totentry, overflow_num, pktin, totinstall, pktnum)
-                elif pktnum >= validate_point:
-                    d.record(fnum, curtime, totentry, overflow_num, pktin, totinstall, pktnum)
-                
-                d.print_checkpoint(fnum, log_prefix+'_checkpoint.txt')
+                check_point(para, d, fnum, curtime, overflow_num, pktin, pktnum, 
+                            prof)
 
-                if 'save_model' in para:
-                    c.predictor.save_weights(log_prefix)
+        if snapshot_interval is not None and pktnum%snapshot_interval == 0:
+            flush_runs(pending)
+            state = {'data': d, 'curtime': curtime, 'overflow_num': overflow_num,
+                     'pktnum': pktnum, 'pktin': pktin, 
+                     'unit_updates': unit_updates, 
+                     'n_units_updates': n_units_updates,
+                     'visited_check_points': visited_check_points}
+            save_snapshot(para, state, prof)
 
-    d.record_install_num(c.install_num)
+    flush_runs(pending)
 
-    d.print_data(log_prefix)
+    finish(para, d, source, prof)
 
-    if 'save_model' in para:
-        c.predictor.save_model(log_prefix)
+    return d
 
-    return
+
+def simulate_event(para):
+    """Discrete-event variant of simulate. Switch state only changes when an
+    event fires: a packet arrival, a rule expiry (per-switch wakeup at the 
+    earliest deadline), a controller response (instructions applied 
+    CONTROLLER_DELAY after the packet-in, then the packet resumes) or a 
+    predictor tick (every update_interval). Packets are still injected one 
+    after another, each when the previous one has been delivered.
+    """
+    n = para['net']
+    mode = para['mode']
+    check_interval = para['check_interval']
+    predictor_name = para['predictor_name']
+    update_interval = para['update_interval']
+
+    if (para.get('snapshot_interval') is not None or para.get('resume') or 
+        para.get('fast_forward')):
+        raise NameError('Error. Snapshots and fast-forward need the per-packet '
+                        'simulation. Exit.')
+
+    c = n.controller
+    c.add_predictor(predictor_name)
+    visited_check_points = set()
+
+    source = get_source(para)
+    items = source.stream()
+    d = data.Data()
+    prof = profiler.attach(para, d)
+    q = event.EventQueue()
+    wakeup = {}  # label -> time of the earliest pending expiry event
+    stat = {'overflow': 0, 'pktin': 0, 'pktnum': 0, 'tick': 0, 'done': False}
+
+    def schedule_expiry(label):
+        t = n.switches[label].next_expiry()
+        if t is not None and (label not in wakeup or t < wakeup[label]):
+            wakeup[label] = t
+            q.push(t, setting.EVENT_EXPIRE, label)
+
+    def sync_switch(label, curtime):
+        [expire, overflow] = n.switches[label].update(curtime)
+        stat['overflow'] += len(overflow)
+        instractions = c.flow_removed(label, expire, overflow, curtime, mode)
+        n.process_ctrl_messages(instractions)
+        schedule_expiry(label)
+
+    def inject(curtime):
+        item = next(items, None)
+        if item is None:
+            stat['done'] = True
+        else:
+            q.push(curtime, setting.EVENT_ARRIVAL, item)
+
+    def deliver(item, start):
+        (pkt, fnum, flowsize) = item
+        stat['pktnum'] += 1
+        pkttime = c.get_path_delay(pkt.path, pkt.pktin, pkt.size)
+        curtime = start+pkttime
+
+        d.record_fct(pkt.flow, pkttime, flowsize)
+
+        if fnum%check_interval == 0 and fnum not in visited_check_points:
+            visited_check_points.add(fnum)
+            check_point(para, d, fnum, curtime, stat['overflow'], 
+                        stat['pktin'], stat['pktnum'], prof)
+
+        inject(curtime)
+
+    def forward(item, label, hop, start, curtime):
+        pkt = item[0]
+        sw = n.switches[label]
+        while True:
+            pkt.path = c.extend_path(pkt.path, sw.label)
+            if pkt.dst == sw.label:
+                deliver(item, start)
+                return
+
+            [pkt, next_hop] = sw.recv_pkt(pkt, curtime)
+            hop += 1
+            assert hop < 10*len(n.topo)
+            if next_hop == setting.CTRL:
+                stat['pktin'] += 1
+                pkt.pktin += 1
+                instractions = c.packet_in(sw.label, pkt, curtime, mode)
+                q.push(curtime+setting.CONTROLLER_DELAY, setting.EVENT_RESPONSE,
+                       (item, sw.label, hop, start, instractions))
+                return
+            sw = n.switches[next_hop]
+
+    def respond(cont, curtime):
+        (item, label, hop, start, instractions) = cont
+        for (act, _, entry) in instractions:  # timeouts start at install time
+            if act == setting.INST_ADD and hasattr(entry, 'ts'):
+                entry.ts = curtime
+        n.process_ctrl_messages(instractions)
+        # new rules may overflow tables and bring earlier deadlines
+        labels = set([obj for (act, obj, _) in instractions 
+                      if act == setting.INST_ADD])
+        for l in sorted(labels):
+            sync_switch(l, curtime)
+        forward(item, label, hop, start, curtime)
+
+    def tick(curtime):
+        if predictor_name == setting.PREDICTOR_SIMPLE:
+            for label in range(n.switch_num):
+                inst = [(setting.INST_QUERY, setting.INST_OBJ_TABLE, label)]
+                ret = n.process_ctrl_messages(inst)
+                entry_num = ret[setting.INST_OBJ_TABLE]
+                c.predictor.update((setting.INFO_TABLE_SIZE, label, 
+                                    curtime, entry_num))
+            if stat['tick'] % setting.ITM_N == 0:
+                c.predictor.update_t_max()
+        else:
+            c.predictor.train()
+        stat['tick'] += 1
+        q.push(curtime+update_interval, setting.EVENT_TICK)
+
+    inject(0)
+    if predictor_name in [setting.PREDICTOR_SIMPLE, setting.PREDICTOR_Q, 
+                          setting.PREDICTOR_DQN]:
+        q.push(0, setting.EVENT_TICK)
+
+    while not stat['done']:
+        (curtime, kind, cont) = q.pop()
+        if kind == setting.EVENT_EXPIRE:
+            if wakeup.get(cont) == curtime:
+                del wakeup[cont]
+            sync_switch(cont, curtime)
+        elif kind == setting.EVENT_RESPONSE:
+            respond(cont, curtime)
+        elif kind == setting.EVENT_ARRIVAL:
+            cont[0].path = 0
+            cont[0].pktin = 0
+            forward(cont, cont[0].src, 0, curtime, curtime)
+        elif kind == setting.EVENT_TICK:
+            tick(curtime)
+        else:
+            raise NameError('Error. No such event. Exit.')
+
+    finish(para, d, source, prof)
+
+    return d
 
 
 def cross_validate():
@@ -146,12 +514,17 @@ def cross_validate():
 
         predictor_name = setting.PREDICTOR_DQN
         
-        fold_size = len(n.traffic.pkts) / 10
+        import numpy
+        t = traffic.ColumnarTraffic()
+        t.add_pkts(n.traffic.pkts)
+        fold_size = t.get_size() / 10
 
         log_prefix = './data/test/cross_validate_{}'.format(k)
 
-        validate = n.traffic.pkts[k * fold_size : (k + 1) * fold_size]
-        n.traffic.pkts = n.traffic.pkts[ : k * fold_size] + n.traffic.pkts[(k + 1) * fold_size : ] + validate
+        # the k-th fold moved to the end as the validation set
+        pos = numpy.arange(t.get_size())
+        fold = (pos >= k * fold_size) & (pos < (k + 1) * fold_size)
+        n.traffic = t.take(numpy.concatenate([pos[~fold], pos[fold]]))
         
         para = {
             'net': n,
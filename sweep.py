@@ -0,0 +1,127 @@
+#  run a grid of simulations on a process pool
+
+
+from __future__ import print_function
+import setting
+
+
+MODE_NAMES = {
+    setting.MODE_DEFAULT: 'default',
+    setting.MODE_SPATH: 'spath',
+    setting.MODE_HARD: 'hard', 
+    setting.MODE_IDLE: 'idle',
+    setting.MODE_HYBRID: 'hybrid',
+}
+PREDICTOR_NAMES = {
+    setting.PREDICTOR_DEFAULT: 'no',
+    setting.PREDICTOR_SIMPLE: 'itm',
+    setting.PREDICTOR_Q: 'q',
+    setting.PREDICTOR_DQN: 'dqn'
+}
+
+# name: (topo, soft labels, traffic pkl)
+SCENARIOS = {
+    'single': (setting.SINGLE, None, setting.SINGLE_TRAFFIC_LOGFILE),
+    'cb': (setting.SINGLE, None, setting.CB_TRACE_LOGFILE),
+    'ge50': (setting.GE50, None, setting.GE50_TRAFFIC_LOGFILE),
+    'brain': (setting.BRAIN, None, setting.BRAIN_TRAFFIC_LOGFILE),
+}
+
+
+def grid(scenarios, ruleset_pkls, modes, predictor_names, timeouts, 
+         out_dir='./data', check_interval=1000, **para):
+    """one cell per (scenario, ruleset pkl, mode, predictor, timeout);
+    extra keyword arguments are passed on to simulate() via para. Cells 
+    are named, and log, by their coordinates, so these must not collide
+    """
+    from itertools import product
+    from os.path import basename, join
+    cells = []
+    for (scenario, ruleset_pkl, mode, predictor_name, timeout) in product(
+            scenarios, ruleset_pkls, modes, predictor_names, timeouts):
+        name = '{}_{}_{}_{}_{}'.format(scenario, 
+                                       basename(ruleset_pkl).replace('.pkl', ''),
+                                       MODE_NAMES[mode], 
+                                       PREDICTOR_NAMES[predictor_name],
+                                       '{:g}'.format(timeout/1e6))
+        cell = {
+            'name': name,
+            'scenario': scenario,
+            'ruleset_pkl': ruleset_pkl,
+            'mode': mode,
+            'predictor_name': predictor_name,
+            'setting': {'DEFAULT_TIMEOUT': timeout},
+            'log_prefix': join(out_dir, name),
+            'check_interval': check_interval,
+            'update_interval': setting.DEFAULT_UPDATE,
+        }
+        cell.update(para)
+        cells.append(cell)
+    for key in ['name', 'log_prefix']:
+        if len(set(cell[key] for cell in cells)) < len(cells):
+            raise NameError('Error. Duplicate cell {} in the grid. Exit.'.format(key))
+    return cells
+
+
+def run_cell(cell):
+    """run one simulation; called in a fresh worker process, so overrides in 
+    cell['setting'] never leak into other cells
+    """
+    from time import time
+    import network
+    import simulate
+
+    for name in cell.get('setting', {}):
+        setattr(setting, name, cell['setting'][name])
+
+    (topo, soft_labels, traffic_pkl) = SCENARIOS[cell['scenario']]
+    n = network.Network(topo, soft_labels=soft_labels, 
+                        ruleset_pkl=cell['ruleset_pkl'])
+    n.generate_log_traffic(traffic_pkl)
+
+    para = {key: cell[key] for key in cell 
+            if key not in ['name', 'scenario', 'ruleset_pkl', 'setting']}
+    para['net'] = n
+    start = time()
+    d = simulate.simulate(para)
+
+    summary = {'name': cell['name'], 'time': time()-start}
+    for (key, record) in [('delay', d.delay), ('totentry', d.totentry),
+                          ('overflow', d.overflow), ('pktin', d.pktin), 
+                          ('totinstall', d.totinstall), ('pktnum', d.pktnum)]:
+        summary[key] = record[key][-1] if len(record[key]) > 0 else None
+    return summary
+
+
+def sweep(cells, summary_file, processes=None):
+    from multiprocessing import Pool
+    from json import dumps
+
+    pool = Pool(processes, maxtasksperchild=1)
+    try:
+        summaries = pool.map(run_cell, cells, chunksize=1)
+    finally:
+        pool.close()
+        pool.join()
+
+    with open(summary_file, 'w') as f:
+        print(dumps(summaries), file=f)
+    return summaries
+
+
+if __name__ == '__main__':
+    from sys import argv
+
+    processes = None
+    if len(argv) == 2:
+        processes = int(argv[1])
+
+    modes = [setting.MODE_HARD, setting.MODE_IDLE, setting.MODE_HYBRID]
+    predictor_names = [setting.PREDICTOR_DEFAULT, setting.PREDICTOR_SIMPLE,
+                       setting.PREDICTOR_Q, setting.PREDICTOR_DQN]
+    timeouts = [i*1e6 for i in range(1, 11)]
+    cells = grid(['single'], [setting.SINGLE_RULE_PKL], modes, 
+                 predictor_names, timeouts)
+    cells += grid(['cb'], [setting.CB_RULE_PKL], modes, 
+                  predictor_names, timeouts)
+    sweep(cells, './data/sweep_summary.json', processes)
@@ -3,19 +3,16 @@
 
 from __future__ import print_function
 import element
+import setting
 
 
 def synflow2pkt(src, dst, burst_max=1, exp=1, pktsize=1500, dup=1):
     from random import randint
     pkt_set = []
-    srcip = '{}.{}.{}.{}'.format(randint(0, 255),
-                                 randint(0, 255),
-                                 src,
-                                 randint(0, 255))
-    dstip = '{}.{}.{}.{}'.format(randint(0, 255),
-                                 randint(0, 255),
-                                 dst,
-                                 randint(0, 255))
+    srcip = (randint(0, 255) << 24 | randint(0, 255) << 16 | 
+             src << 8 | randint(0, 255))
+    dstip = (randint(0, 255) << 24 | randint(0, 255) << 16 | 
+             dst << 8 | randint(0, 255))
     srcport = randint(1, 65535)
     dstport = randint(1, 65535)
     protocol = 6
@@ -26,102 +23,454 @@ def synflow2pkt(src, dst, burst_max=1, exp=1, pktsize=1500, dup=1):
     return pkt_set
 
 
+def has_repeat(flows):  # whether rows of FLOW_FIELDS repeat a 5-tuple
+    import numpy
+    hi = (flows['srcip'].astype(numpy.uint64) << numpy.uint64(32) | 
+          flows['dstip'].astype(numpy.uint64))
+    lo = (flows['srcport'].astype(numpy.uint64) << numpy.uint64(16) | 
+          flows['dstport'].astype(numpy.uint64))
+    # one sort on a mixed 64-bit key; only its collisions need the exact check
+    key = numpy.sort(hi ^ (lo*numpy.uint64(0x9e3779b97f4a7c15)))
+    if not numpy.any(key[1:] == key[:-1]):
+        return False
+    order = numpy.lexsort((lo, hi))
+    return bool(numpy.any((hi[order][1:] == hi[order][:-1]) & 
+                          (lo[order][1:] == lo[order][:-1])))
+
+
+def synflows2cols(srcs, dsts, bursts, pktsize, rng, trace_file=None):
+    """ColumnarTraffic of flows src -> dst with bursts packets each, drawn 
+    as synflow2pkt does but for all flows at once from a RandomState. With 
+    trace_file, packets are written to it in batches and the trace returned
+    """
+    import numpy
+    total = len(srcs)
+    srcs = numpy.asarray(srcs, dtype=numpy.int64)
+    dsts = numpy.asarray(dsts, dtype=numpy.int64)
+    bursts = numpy.asarray(bursts, dtype=numpy.int64)
+    rand_ip = lambda sub: (rng.randint(0, 256, total) << 24 | 
+                           rng.randint(0, 256, total) << 16 | 
+                           sub << 8 | rng.randint(0, 256, total))
+    flows = numpy.zeros(total, dtype=trace_dtypes()[1][1])
+    flows['srcip'] = rand_ip(srcs)
+    flows['dstip'] = rand_ip(dsts)
+    flows['srcport'] = rng.randint(1, 65536, total)
+    flows['dstport'] = rng.randint(1, 65536, total)
+    flows['protocol'] = 6  # TCP packets
+
+    def get_cols(start, end):  # packets of flows [start, end), ids as indices
+        flow = numpy.repeat(numpy.arange(start, end), bursts[start:end])
+        cols = numpy.zeros(len(flow), dtype=PKT_FIELDS)
+        for name in FLOW_FIELDS:
+            cols[name] = flows[name][flow]
+        cols['size'] = pktsize
+        cols['ts'] = numpy.nan
+        cols['flow'] = flow
+        cols['src'] = srcs[flow]
+        cols['dst'] = dsts[flow]
+        return cols
+
+    if has_repeat(flows):  # rare: intern flow by flow
+        t = ColumnarTraffic()
+        t.add_cols(get_cols(0, total))
+    elif trace_file is None:
+        t = ColumnarTraffic(get_cols(0, total), flows)
+    else:
+        pktnum = int(bursts.sum())
+        w = TraceWriter(trace_file, {'cols': pktnum, 'tps': total, 
+                                     'flownum': pktnum, 'flowbytes': total})
+        w.write('tps', flows)
+        w.write('flowbytes', bursts*pktsize)
+        batch = max(setting.PKT_CHUNK//max(int(bursts.mean()), 1), 1)
+        for start in range(0, total, batch):
+            cols = get_cols(start, min(start+batch, total))
+            w.write('cols', cols)
+            w.write('flownum', cols['flow']+1)
+        w.close()
+        return load_trace(trace_file)
+    if trace_file is not None:
+        t.save_trace(trace_file)
+    return t
+
+
 def pcap2pkts(pcap_file):
-    pkts = []
-    import dpkt
-    from socket import inet_aton, inet_ntoa
+    return list(iter_pcap(pcap_file))
+
+
+def iter_pcap(pcap_file):  # yield packets one by one
+    names = ['srcip', 'dstip', 'srcport', 'dstport', 'protocol', 'size', 'ts']
+    for cols in pcap_chunks(pcap_file):
+        (srcip, dstip, srcport, dstport, protocol, size, ts) = \
+            [get_column(cols, name) for name in names]
+        for i in range(len(cols)):
+            yield Packet((srcip[i], dstip[i], srcport[i], dstport[i], 
+                          protocol[i]), size[i], ts[i])
+
+
+ETH_TYPE_IP = 0x0800
+ETH_TYPES_VLAN = [0x8100, 0x88a8, 0x9100, 0x9200]
+
+
+def pcap_chunks(pcap_file, chunk_size=setting.PKT_CHUNK, stats=None):
+    """Parse an Ethernet pcap in place (mmap) and yield chunks of at most 
+    chunk_size TCP/UDP over IPv4 packets as structured arrays of PKT_FIELDS 
+    (flow ids left 0). Headers are read at fixed offsets (up to two VLAN 
+    tags), as dpkt does; other frames are skipped and malformed ones counted
+    as invalid, reported once at the end. stats, if given, gets the counts.
+    """
+    import mmap
+    import numpy
+    from struct import unpack_from
+
+    if stats is None:
+        stats = {}
+    stats.update({'frames': 0, 'packets': 0, 'skipped': 0, 'invalid': 0})
     with open(pcap_file, 'rb') as f:
-        for [ts, pkt] in dpkt.pcap.Reader(f):
-            try:
-                eth = dpkt.ethernet.Ethernet(pkt)
-                if isinstance(eth.data, dpkt.ip.IP):
-                    ip = eth.data
-                    size = ip.len+18  # plus Ethernet header
-                    srcip = inet_ntoa(ip.src)
-                    dstip = inet_ntoa(ip.dst)
-                    if isinstance(ip.data, dpkt.tcp.TCP):
-                        tcp = ip.data
-                        protocol = 6
-                        srcport = tcp.sport
-                        dstport = tcp.dport
-                    elif isinstance(ip.data, dpkt.udp.UDP):
-                        udp = ip.data
-                        protocol = 17
-                        srcport = udp.sport
-                        dstport = udp.dport
-                    else:
-                        continue
-                else:
-                    continue
-                pkts.append(Packet((srcip, dstip, srcport, dstport, protocol), size, ts))
-            except:
-                print('Warning. Invalid packet. Drop it.')
+        if len(f.read(24)) < 24:
+            return
+        mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    try:
+        (magic,) = unpack_from('<I', mm, 0)
+        if magic in [0xa1b2c3d4, 0xa1b23c4d]:
+            endian = '<'
+        elif magic in [0xd4c3b2a1, 0x4d3cb2a1]:
+            endian = '>'
+        else:
+            raise NameError('Error. Not a valid pcap file. Exit.')
+        divisor = 1e9 if magic in [0xa1b23c4d, 0x4d3cb2a1] else 1e6
+        rec = endian+'IIII'
+        end = len(mm)
+        pos = 24
+        while pos+16 <= end:
+            # frame offsets of the chunk: the only per-frame Python work
+            start = pos
+            offs = []
+            caps = []
+            tss = []
+            while pos+16 <= end and len(offs) < chunk_size:
+                (sec, frac, caplen, _) = unpack_from(rec, mm, pos)
+                pos += 16
+                caplen = min(caplen, end-pos)
+                offs.append(pos)
+                caps.append(caplen)
+                tss.append(sec+frac/divisor)
+                pos += caplen
+            stats['frames'] += len(offs)
+            # parsed from a copy of the chunk: no view of mm outlives it, so 
+            # mm closes on any interpreter, even with a traceback alive
+            buf = numpy.frombuffer(mm[start:pos], dtype=numpy.uint8)
+            cols = parse_frames(buf, numpy.array(offs, dtype=numpy.int64)-start, 
+                                numpy.array(caps, dtype=numpy.int64), 
+                                numpy.array(tss), stats)
+            if len(cols) != 0:
+                yield cols
+    finally:
+        mm.close()
+    if stats['invalid'] != 0:
+        print('Warning. {} invalid packets. Drop them.'.format(stats['invalid']))
+
+
+def parse_frames(buf, off, caplen, ts, stats):
+    # vectorized header parsing of the frames at off in buf (uint8 array)
+    import numpy
+
+    last = len(buf)-1
+    stop = off+caplen
+
+    def u8(pos):
+        return buf[numpy.minimum(pos, last)].astype(numpy.int64)
+
+    def u16(pos):
+        return u8(pos) << 8 | u8(pos+1)
+
+    def u32(pos):
+        return u16(pos) << 16 | u16(pos+2)
+
+    invalid = caplen < 14  # shorter than an Ethernet header
+    eth_type = u16(off+12)
+    l3 = off+14
+    # 802.1Q and QinQ: a first tag of any VLAN type, a second one after 8100
+    tagged = numpy.isin(eth_type, ETH_TYPES_VLAN) & ~invalid
+    for _ in range(2):
+        invalid |= tagged & (l3+4 > stop)
+        tagged &= ~invalid
+        eth_type = numpy.where(tagged, u16(l3+2), eth_type)
+        l3 = numpy.where(tagged, l3+4, l3)
+        tagged &= eth_type == ETH_TYPES_VLAN[0]
+
+    ip = ~invalid & (eth_type == ETH_TYPE_IP) & (l3+20 <= stop)
+    hl = (u8(l3) & 0xf) << 2
+    ip &= hl >= 20
+    ip_len = u16(l3+2)
+    protocol = u8(l3+9)
+    unfragmented = (u16(l3+6) & 0x1fff) == 0
+    l4 = l3+hl
+    l4_stop = numpy.where(ip_len != 0, numpy.minimum(l3+ip_len, stop), stop)
+    l4_len = l4_stop-l4
+    tcp = ip & unfragmented & (protocol == 6) & (l4_len >= 20)
+    tcp &= (u8(l4+12) >> 4) >= 5
+    udp = ip & unfragmented & (protocol == 17) & (l4_len >= 8)
+    keep = tcp | udp
+
+    stats['invalid'] += int(numpy.count_nonzero(invalid))
+    stats['skipped'] += int(numpy.count_nonzero(~keep & ~invalid))
+    stats['packets'] += int(numpy.count_nonzero(keep))
+
+    (l3, l4) = (l3[keep], l4[keep])
+    cols = numpy.zeros(len(l3), dtype=PKT_FIELDS)
+    cols['srcip'] = u32(l3+12)
+    cols['dstip'] = u32(l3+16)
+    cols['srcport'] = u16(l4)
+    cols['dstport'] = u16(l4+2)
+    cols['protocol'] = protocol[keep]
+    cols['size'] = ip_len[keep]+18  # plus Ethernet header
+    cols['ts'] = ts[keep]
+    cols['src'] = (cols['srcip'] >> 8) & 0xff  # see element.get_subnet
+    cols['dst'] = (cols['dstip'] >> 8) & 0xff
+    return cols
+
+
+def load_flowsize(json_file):  # flow sizes from print_traffic_data output
+    from json import loads
+    from ast import literal_eval
+    with open(json_file, 'r') as f:
+        data = loads(f.readline())
+    return {element.tp2int(literal_eval(tp)): data['flowsize'][tp] 
+            for tp in data['flowsize']}
+
+
+TRACE_ALIGN = 64
 
-    return pkts
 
+def trace_dtypes():  # on-disk sections in order, fixed little-endian dtypes
+    return [('cols', [(name, '<'+t) for (name, t) in PKT_FIELDS]),
+            ('tps', [(name, '<i8') for name in FLOW_FIELDS]),
+            ('flownum', '<i8'), ('flowbytes', '<f8')]
+
+
+class TraceWriter:
+    """Versioned columnar trace file: magic, header length, a JSON header 
+    with the (offset, length) of each section, then the sections of 
+    trace_dtypes as raw arrays aligned to TRACE_ALIGN bytes. Section lengths
+    are fixed up front; rows may then be written in batches, in any order.
+    """
+    def __init__(self, trace_file, lengths):
+        import numpy
+        from json import dumps
+        from struct import pack
+
+        # the header has a fixed width for given lengths, so it is sized 
+        # with zero offsets first
+        def get_header(offsets):
+            sections = {name: (offsets.get(name, 0), lengths[name]) 
+                        for (name, _) in trace_dtypes()}
+            return dumps({'version': setting.TRACE_VERSION, 
+                          'pktnum': lengths['cols'], 'sections': sections}, 
+                         sort_keys=True)
+
+        def align(pos):
+            return (pos+TRACE_ALIGN-1)//TRACE_ALIGN*TRACE_ALIGN
+
+        header_len = len(get_header({}))+20*len(lengths)  # room for offsets
+        pos = align(len(setting.TRACE_MAGIC)+4+header_len)
+        self.offsets = {}
+        for (name, dtype) in trace_dtypes():
+            self.offsets[name] = pos
+            pos = align(pos+lengths[name]*numpy.dtype(dtype).itemsize)
+        header = get_header(self.offsets).ljust(header_len).encode()
+
+        self.lengths = lengths
+        self.written = {name: 0 for name in lengths}
+        self.f = open(trace_file, 'wb')
+        self.f.write(setting.TRACE_MAGIC+pack('<I', header_len)+header)
+        self.f.truncate(pos)
+
+    def write(self, name, rows):  # append rows to section name
+        import numpy
+        dtype = numpy.dtype(dict(trace_dtypes())[name])
+        if self.written[name]+len(rows) > self.lengths[name]:
+            raise NameError('Error. Too many rows for trace section {}. Exit.'
+                            .format(name))
+        self.f.seek(self.offsets[name]+self.written[name]*dtype.itemsize)
+        numpy.asarray(rows).astype(dtype).tofile(self.f)
+        self.written[name] += len(rows)
+        return
+
+    def close(self):
+        self.f.close()
+        if self.written != self.lengths:
+            raise NameError('Error. Incomplete trace. Exit.')
+        return
+
+
+def load_trace(trace_file):
+    """a ColumnarTraffic over a trace file written by save_trace: the header 
+    is parsed and every section memory-mapped, so opening is independent of 
+    the trace size and slicing reads only the rows it touches
+    """
+    import numpy
+    from json import loads
+    from struct import unpack
+    with open(trace_file, 'rb') as f:
+        magic = f.read(len(setting.TRACE_MAGIC))
+        if magic != setting.TRACE_MAGIC:
+            raise NameError('Error. Not a valid trace file. Exit.')
+        (header_len,) = unpack('<I', f.read(4))
+        header = loads(f.read(header_len).decode())
+    if header['version'] != setting.TRACE_VERSION:
+        raise NameError('Error. Unsupported trace version {}. Exit.'
+                        .format(header['version']))
+    arrays = {}
+    for (name, dtype) in trace_dtypes():
+        (offset, length) = header['sections'][name]
+        if length == 0:  # an empty file region cannot be mapped
+            arrays[name] = numpy.zeros(0, dtype=dtype)
+        else:
+            arrays[name] = numpy.memmap(trace_file, dtype=dtype, mode='r', 
+                                        offset=offset, shape=(length,))
+    return ColumnarTraffic(arrays['cols'], arrays['tps'], arrays['flownum'], 
+                           arrays['flowbytes'])
+
+
+def load_traffic(filename):  # Traffic from a pickle or ColumnarTraffic from a trace
+    if filename.endswith(setting.TRACE_EXT):
+        return load_trace(filename)
+    t = element.de_serialize(filename)
+    t.normalize_addr()
+    return t
+
+
+def pkl2trace(pkl_file, trace_file):  # convert a pickled Traffic
+    t = load_traffic(pkl_file)
+    ct = ColumnarTraffic()
+    ct.add_pkts(t.pkts)
+    ct.save_trace(trace_file)
+    return ct
+
+
+class Packet(object):
+    #  tp = (srcip, dstip, srcport, dstport, protocol, ...), ips as integers
+    __slots__ = ('tp', 'size', 'ts', 'label', 'path', 'pktin', 'flow', 'srcip', 
+                 'dstip', 'src', 'dst', 'srcport', 'dstport', 'protocol')
+
+    def __init__(self, tp=None, size=1500, ts=None):  # maximum Ethernet frame
+        if tp is not None and isinstance(tp[0], str):  # dotted-quad input
+            tp = element.tp2int(tp)
 
-class Packet:
-    #  tp = (srcip, dstip, srcport, dstport, protocol, ...)
-    def __init__(self, tp, size=1500, ts=None):  # maximum Ethernet frame
         self.tp = tp
         self.size = size
         self.ts = ts  # real world timestamp
 
         self.label = None
-        self.path = []
+        self.path = 0  # path id, see Controller.extend_path
+        self.pktin = 0
+        self.flow = None  # dense flow id, interned by the traffic source
 
         if tp is not None:
             self.srcip = tp[0]
             self.dstip = tp[1]
 
-            self.src = int(self.srcip.split('.')[2])
-            self.dst = int(self.dstip.split('.')[2])
+            self.src = element.get_subnet(self.srcip)
+            self.dst = element.get_subnet(self.dstip)
 
             if len(tp) == 5:
                 self.srcport = tp[2]
                 self.dstport = tp[3]
                 self.protocol = tp[4]
 
+    def __getstate__(self):
+        return {name: getattr(self, name) for name in self.__slots__ 
+                if hasattr(self, name)}
+
+    def __setstate__(self, state):  # also restores pickles of dict-based packets
+        for name in state:
+            setattr(self, name, state[name])
+        if not isinstance(self.path, int):  # path list of older pickles
+            self.path = 0
+            self.pktin = 0
+        if 'flow' not in state:
+            self.flow = None
+
     def __repr__(self):
         return 'Packet()'
 
     def __str__(self):
-        return '{}({})'.format(self.tp, self.size)
+        return '{}({})'.format(element.addr2str(self.tp), self.size)
 
     def print_pkt(self, filename=None):
-        print('{}({})'.format(self.tp, self.size), file=filename)
+        print('{}({})'.format(element.addr2str(self.tp), self.size), file=filename)
         return 0
 
 
 class Traffic:
+    """Packets with flows interned at ingest: pkt.flow indexes tps (the 
+    5-tuples, in order of first appearance) and the per-flow flowbytes
+    """
     def __init__(self, pcap_file=None):
         self.pkts = []
 
-        self.flowsize = {}
+        self.tps = []  # flow id -> 5-tuple
+        self.flowid = {}  # 5-tuple -> flow id
+        self.flowbytes = []  # flow id -> bytes
         self.flownum = []
 
         if pcap_file is not None:
             pkts = pcap2pkts(pcap_file)
             self.add_pkts(pkts)
 
+    def __setstate__(self, state):  # re-interns pickles without flow ids
+        self.__dict__.update(state)
+        if 'tps' not in state:
+            self.__dict__.pop('flowsize', None)
+            self.reindex()
+
+    def reindex(self):  # flow ids and counts rebuilt from the packets
+        pkts = self.pkts
+        self.__init__()
+        self.add_pkts(pkts)
+        return
+
+    @property
+    def flowsize(self):  # 5-tuple -> bytes
+        return dict(zip(self.tps, self.flowbytes))
+
+    def normalize_addr(self):
+        # upgrade traffic pickled with dotted-quad addresses in place
+        if len(self.pkts) == 0 or not isinstance(self.pkts[0].srcip, str):
+            return
+        for pkt in self.pkts:
+            pkt.tp = element.tp2int(pkt.tp)
+            pkt.srcip = pkt.tp[0]
+            pkt.dstip = pkt.tp[1]
+        self.reindex()
+        return
+
     def get_size(self):
         return len(self.pkts)
 
     def add_pkts(self, pkts):
         self.pkts += pkts
+        flowid = self.flowid
         for pkt in pkts:
             tp = pkt.tp  # define a flow
-            if tp in self.flowsize:
-                self.flowsize[tp] += pkt.size
-            else:
-                self.flowsize[tp] = pkt.size
-            self.flownum.append(len(self.flowsize)) 
+            flow = flowid.get(tp)
+            if flow is None:
+                flow = len(self.tps)
+                flowid[tp] = flow
+                self.tps.append(tp)
+                self.flowbytes.append(0)
+            pkt.flow = flow
+            self.flowbytes[flow] += pkt.size
+            self.flownum.append(len(self.tps)) 
         return 0
 
+    def stream(self):  # yield (pkt, flow number so far, flow size)
+        for i in range(len(self.pkts)):
+            pkt = self.pkts[i]
+            yield (pkt, self.flownum[i], self.flowbytes[pkt.flow])
+
     def serialize(self, pkl_file):
-        from pickle import dump, HIGHEST_PROTOCOL
-        with open(pkl_file, 'wb') as obj:
-            dump(self, obj, HIGHEST_PROTOCOL)
+        element.serialize(self, pkl_file)
 
     def print_traffic(self, filename=None):
         for pkt in self.pkts:
@@ -131,8 +480,8 @@ class Traffic:
         from json import dumps
         with open(json_file, 'w') as f:
             flowsize_str = {}
-            for tp in self.flowsize:
-                flowsize_str[str(tp)] = self.flowsize[tp]
+            for (tp, size) in zip(self.tps, self.flowbytes):
+                flowsize_str[str(element.addr2str(tp))] = size
             data = {
                 'pktnum': len(self.pkts), 
                 'flownum': self.flownum,
@@ -142,11 +491,299 @@ class Traffic:
         return
 
 
+PKT_FIELDS = [('srcip', 'u4'), ('dstip', 'u4'), ('srcport', 'u2'), 
+              ('dstport', 'u2'), ('protocol', 'u1'), ('size', 'u4'), 
+              ('ts', 'f8'), ('flow', 'i8'), ('src', 'i4'), ('dst', 'i4')]
+FLOW_FIELDS = ['srcip', 'dstip', 'srcport', 'dstport', 'protocol']
+
+
+def flow_tuples(flows):  # rows of FLOW_FIELDS -> list of 5-tuples
+    return list(zip(*[get_column(flows, name) for name in FLOW_FIELDS]))
+
+
+def get_column(cols, name):
+    # a column as a list of Python ints (floats for ts), not the longs 
+    # that unsigned columns convert to
+    if name == 'ts':
+        return cols[name].tolist()
+    return cols[name].astype(int).tolist()
+
+
+class ColumnarTraffic:
+    """Traffic stored column-wise in a NumPy structured array (PKT_FIELDS), 
+    one row per packet. flow is the interned flow id: the index of the 
+    packet's 5-tuple in tps, numbered in order of first appearance, so the 
+    flow number so far is a running maximum. ts is NaN if unknown.
+    Offers the reading interface of Traffic (stream, flownum, flowsize, 
+    print_traffic_data); Packet objects are only built while streaming.
+    Columns may be memory-mapped (see load_trace). tps may also be an array
+    of FLOW_FIELDS rows, turned into a list only when tuples are needed.
+    """
+    def __init__(self, cols=None, tps=None, flownum=None, flowbytes=None):
+        import numpy
+        if cols is None:
+            cols = numpy.zeros(0, dtype=PKT_FIELDS)
+            tps = []
+        self.cols = cols
+        self.tps = tps  # flow id -> 5-tuple
+        self.flowid = None  # 5-tuple -> flow id, built on first intern
+        if flownum is None:
+            self.index()
+        else:
+            self.flownum = flownum
+            self.flowbytes = flowbytes
+
+    def __getstate__(self):
+        return {'cols': self.cols, 'tps': self.tps}
+
+    def __setstate__(self, state):
+        self.__init__(state['cols'], state['tps'])
+
+    def index(self):  # per-packet flow numbers and per-flow byte counts
+        import numpy
+        flow = self.cols['flow']
+        if len(flow) == 0:
+            self.flownum = numpy.zeros(0, dtype=numpy.int64)
+        else:
+            self.flownum = numpy.maximum.accumulate(flow)+1
+        self.flowbytes = numpy.bincount(flow, weights=self.cols['size'], 
+                                        minlength=len(self.tps))
+        return
+
+    def get_tps(self):  # the flow table as a list of 5-tuples
+        if not isinstance(self.tps, list):
+            self.tps = flow_tuples(self.tps)
+        return self.tps
+
+    def intern(self, tp):  # the flow id of tp, a new one if unseen
+        if self.flowid is None:
+            self.flowid = {tp: i for (i, tp) in enumerate(self.get_tps())}
+        if tp not in self.flowid:
+            self.flowid[tp] = len(self.tps)
+            self.tps.append(tp)
+        return self.flowid[tp]
+
+    @property
+    def flowsize(self):  # 5-tuple -> bytes, as Traffic.flowsize
+        return dict(zip(self.get_tps(), self.flowbytes.astype(int).tolist()))
+
+    def get_size(self):
+        return len(self.cols)
+
+    def add_pkts(self, pkts):
+        import numpy
+        pkts = list(pkts)
+        cols = numpy.zeros(len(pkts), dtype=PKT_FIELDS)
+        for pkt in pkts:
+            if len(pkt.tp) != 5:
+                raise NameError('Error. Columnar traffic needs 5-tuples. Exit.')
+        for name in ['srcip', 'dstip', 'srcport', 'dstport', 'protocol']:
+            cols[name] = [getattr(pkt, name) for pkt in pkts]
+        cols['size'] = [pkt.size for pkt in pkts]
+        cols['ts'] = [numpy.nan if pkt.ts is None else pkt.ts for pkt in pkts]
+        cols['src'] = [pkt.src for pkt in pkts]  # may differ from the subnet
+        cols['dst'] = [pkt.dst for pkt in pkts]
+        return self.add_cols(cols)
+
+    def add_pcap(self, pcap_file, stats=None):
+        chunks = list(pcap_chunks(pcap_file, stats=stats))
+        if len(chunks) != 0:
+            import numpy
+            self.add_cols(numpy.concatenate(chunks))
+        return 0
+
+    def add_cols(self, cols):
+        """append packet rows of PKT_FIELDS, interning their flows; the 
+        Python work is per distinct flow, not per packet
+        """
+        import numpy
+        if len(cols) == 0:
+            return 0
+        hi = cols['srcip'].astype(numpy.uint64) << 32 | cols['dstip']
+        lo = (cols['srcport'].astype(numpy.uint64) << 24 | 
+              cols['dstport'].astype(numpy.uint64) << 8 | cols['protocol'])
+        order = numpy.lexsort((lo, hi))
+        (hi_s, lo_s) = (hi[order], lo[order])
+        new = numpy.ones(len(order), dtype=bool)
+        new[1:] = (hi_s[1:] != hi_s[:-1]) | (lo_s[1:] != lo_s[:-1])
+        group = numpy.cumsum(new)-1  # distinct flow of each sorted row
+        first = order[new]  # first row of each group (lexsort is stable)
+        ids = numpy.zeros(len(first), dtype=numpy.int64)
+        keys = flow_tuples(cols[first])
+        for g in numpy.argsort(first, kind='mergesort').tolist():
+            ids[g] = self.intern(keys[g])
+        cols = numpy.array(cols)
+        flow = numpy.empty(len(order), dtype=numpy.int64)
+        flow[order] = ids[group]
+        cols['flow'] = flow
+        self.cols = numpy.concatenate([self.cols, cols])
+        self.index()
+        return 0
+
+    def take(self, idx):
+        """the traffic of the packets at idx (a slice, index or boolean 
+        array), in that order; flow ids are renumbered by first appearance
+        """
+        import numpy
+        cols = numpy.array(self.cols[idx], ndmin=1)  # a copy, not a view
+        if len(cols) == 0:
+            return ColumnarTraffic()
+        (flows, first, inverse) = numpy.unique(cols['flow'], return_index=True,
+                                               return_inverse=True)
+        order = numpy.argsort(first, kind='mergesort')
+        rank = numpy.empty(len(order), dtype=numpy.int64)
+        rank[order] = numpy.arange(len(order))
+        cols['flow'] = rank[inverse]
+        if isinstance(self.tps, list):
+            tps = [self.tps[f] for f in flows[order].tolist()]
+        else:
+            tps = numpy.array(self.tps[flows[order]])
+        return ColumnarTraffic(cols, tps)
+
+    def stream(self):  # yield (pkt, flow number so far, flow size)
+        import numpy
+        names = ['size', 'ts', 'flow', 'src', 'dst']
+        flowbytes = self.flowbytes.astype(int).tolist()
+        for start in range(0, len(self.cols), setting.PKT_CHUNK):
+            cols = self.cols[start:start+setting.PKT_CHUNK]  # read per chunk
+            (size, ts, flow, src, dst) = [get_column(cols, name) for name in names]
+            flownum = self.flownum[start:start+setting.PKT_CHUNK].tolist()
+            tps = self.tps
+            if not isinstance(tps, list):  # tuples of the chunk's flows only
+                (ids, inverse) = numpy.unique(cols['flow'], return_inverse=True)
+                tps = flow_tuples(self.tps[ids])
+                flow_tps = [tps[j] for j in inverse.tolist()]
+            for i in range(len(cols)):
+                if isinstance(self.tps, list):
+                    tp = tps[flow[i]]
+                else:
+                    tp = flow_tps[i]
+                pkt = Packet(tp, size[i], None if numpy.isnan(ts[i]) else ts[i])
+                pkt.src = src[i]
+                pkt.dst = dst[i]
+                pkt.flow = flow[i]
+                yield (pkt, flownum[i], flowbytes[flow[i]])
+
+    def extend(self, other):
+        """append the packets of other ColumnarTraffic, mapping its flow ids
+        onto ours (per distinct flow); flow numbers continue across both
+        """
+        import numpy
+        ids = numpy.zeros(len(other.tps), dtype=numpy.int64)
+        for (i, tp) in enumerate(other.get_tps()):
+            ids[i] = self.intern(tp)
+        cols = numpy.array(other.cols)
+        cols['flow'] = ids[cols['flow']]
+        self.cols = numpy.concatenate([self.cols, cols])
+        self.index()
+        return 0
+
+    def to_traffic(self):
+        t = Traffic()
+        t.pkts = [pkt for (pkt, _, _) in self.stream()]
+        t.tps = list(self.get_tps())
+        t.flowid = {tp: i for (i, tp) in enumerate(t.tps)}
+        t.flowbytes = self.flowbytes.astype(int).tolist()
+        t.flownum = self.flownum.tolist()
+        return t
+
+    def serialize(self, pkl_file):
+        element.serialize(self, pkl_file)
+
+    def save_trace(self, trace_file):  # see TraceWriter
+        import numpy
+        flows = self.tps
+        if isinstance(flows, list):
+            flows = numpy.zeros(len(self.tps), dtype=trace_dtypes()[1][1])
+            for (j, name) in enumerate(FLOW_FIELDS):
+                flows[name] = [tp[j] for tp in self.tps]
+        arrays = {'cols': self.cols, 'tps': flows, 'flownum': self.flownum,
+                  'flowbytes': self.flowbytes}
+        w = TraceWriter(trace_file, {name: len(arrays[name]) for name in arrays})
+        for (name, _) in trace_dtypes():
+            w.write(name, arrays[name])
+        w.close()
+        return
+
+    def print_traffic_data(self, json_file):  # same format as Traffic's
+        from json import dumps
+        flowbytes = self.flowbytes.astype(int).tolist()
+        with open(json_file, 'w') as f:
+            data = {
+                'pktnum': len(self.cols),
+                'flownum': self.flownum.tolist(),
+                'flowsize': {str(element.addr2str(tp)): flowbytes[i] 
+                             for (i, tp) in enumerate(self.get_tps())}
+            }
+            print(dumps(data), file=f)
+        return
+
+
+class FlowSizeSketch:
+    """Count-Min sketch of bytes per flow: fixed memory, never underestimates
+    """
+    def __init__(self, width=setting.SKETCH_WIDTH, depth=setting.SKETCH_DEPTH):
+        from array import array
+        self.width = width
+        self.depth = depth
+        self.rows = [array('d', [0])*width for _ in range(depth)]
+
+    def add(self, tp, size):
+        for i in range(self.depth):
+            self.rows[i][hash((i, tp)) % self.width] += size
+        return
+
+    def estimate(self, tp):
+        return min(self.rows[i][hash((i, tp)) % self.width] 
+                   for i in range(self.depth))
+
+
+class PacketStream:
+    """Packets from any iterable (e.g. iter_pcap, Network.map_pkts) without 
+    materializing them. Flows are interned and counted on the fly. Flow sizes
+    come from a side dict (see load_flowsize) if given; otherwise they are 
+    sketched and only known once the stream is exhausted (flowsize yields 
+    None). get_flowsize takes flow ids.
+    """
+    def __init__(self, pkts, flowsize=None):
+        self.pkts = pkts
+        self.flowsize = flowsize
+        self.sketch = None
+        if flowsize is None:
+            self.sketch = FlowSizeSketch()
+        self.tps = []  # flow id -> 5-tuple
+        self.flowid = {}
+
+    def stream(self):  # yield (pkt, flow number so far, flow size)
+        tps = self.tps
+        flowid = self.flowid
+        for pkt in self.pkts:
+            tp = pkt.tp
+            flow = flowid.get(tp)
+            if flow is None:
+                flow = len(tps)
+                flowid[tp] = flow
+                tps.append(tp)
+            pkt.flow = flow
+            if self.sketch is None:
+                yield (pkt, len(tps), self.flowsize[tp])
+            else:
+                self.sketch.add(tp, pkt.size)
+                yield (pkt, len(tps), None)
+
+    def get_flowsize(self, flow):
+        tp = self.tps[flow]
+        if self.sketch is None:
+            return self.flowsize[tp]
+        return self.sketch.estimate(tp)
+
+
 if __name__ == '__main__': 
     pkt_set = synflow2pkt(1, 10, 10)
     for pkt in pkt_set:
-        assert int(pkt.srcip.split('.')[2]) == 1
-        assert int(pkt.dstip.split('.')[2]) == 10
+        assert element.int2ip(pkt.srcip).split('.')[2] == '1'
+        assert element.int2ip(pkt.dstip).split('.')[2] == '10'
+        assert pkt.src == 1 and pkt.dst == 10
         # pkt.print_pkt()
 
     t = Traffic('sample.pcap')
@@ -160,4 +797,63 @@ if __name__ == '__main__':
         data = loads(f.readline())
         print(data['pktnum'])
         print(data['flownum'])
-        print(data['flowsize'])
\ No newline at end of file
+        print(data['flowsize'])
+    flowsize = load_flowsize('sample.json')
+    assert flowsize == t.flowsize
+
+    for side in [flowsize, None]:
+        s = PacketStream(iter_pcap('sample.pcap'), side)
+        items = list(s.stream())
+        assert [fnum for (_, fnum, _) in items] == t.flownum
+        for (flow, tp) in enumerate(s.tps):
+            assert s.get_flowsize(flow) >= t.flowsize[tp]
+    ct = ColumnarTraffic()
+    ct.add_pkts(iter_pcap('sample.pcap'))
+    assert ct.get_size() == t.get_size()
+    assert ct.flownum.tolist() == t.flownum and ct.flowsize == t.flowsize
+    for ((p1, n1, s1), (p2, n2, s2)) in zip(ct.stream(), t.stream()):
+        assert (p1.tp, p1.size, p1.ts, p1.src, p1.dst) == \
+               (p2.tp, p2.size, p2.ts, p2.src, p2.dst)
+        assert (n1, s1) == (n2, s2)
+    ct.print_traffic_data('sample.json')
+    assert load_flowsize('sample.json') == t.flowsize
+    tail = ct.take(slice(50, None))
+    t2 = Traffic()
+    t2.add_pkts(t.pkts[50:])
+    assert tail.flownum.tolist() == t2.flownum and tail.flowsize == t2.flowsize
+    assert ct.take(slice(0, 0)).get_size() == 0
+
+    stats = {}
+    chunks = list(pcap_chunks('sample.pcap', 32, stats))
+    assert [len(cols) for cols in chunks] == [32, 32, 32, 5]
+    assert stats['frames'] == 101 and stats['invalid'] == 0
+    ct2 = ColumnarTraffic()
+    ct2.add_pcap('sample.pcap')
+    assert ct2.flownum.tolist() == t.flownum and ct2.flowsize == t.flowsize
+
+    ct3 = ColumnarTraffic()
+    ct3.extend(ct.take(slice(0, 50)))
+    ct3.extend(ct.take(slice(50, None)))
+    assert ct3.flownum.tolist() == t.flownum and ct3.tps == ct.tps
+    t3 = ct3.to_traffic()
+    assert [p.tp for p in t3.pkts] == [p.tp for p in t.pkts]
+    assert t3.flownum == t.flownum and t3.flowsize == t.flowsize
+
+    import os
+    ct.save_trace('sample.trace')
+    lt = load_trace('sample.trace')
+    assert lt.flownum.tolist() == t.flownum and lt.flowsize == t.flowsize
+    assert [p.tp for (p, _, _) in lt.stream()] == [p.tp for p in t.pkts]
+    assert lt.take(slice(50, None)).flownum.tolist() == t2.flownum
+    ColumnarTraffic().save_trace('sample.trace')
+    assert load_trace('sample.trace').get_size() == 0
+    os.remove('sample.trace')
+
+    from numpy.random import RandomState
+    syn = synflows2cols([1, 2, 3], [2, 3, 1], [3, 1, 2], 1500, RandomState(5))
+    assert syn.flownum.tolist() == [1, 1, 1, 2, 3, 3] and not has_repeat(syn.tps)
+    assert [p.dst for (p, _, _) in syn.stream()] == [2, 2, 2, 3, 1, 1]
+    syn_trace = synflows2cols([1, 2, 3], [2, 3, 1], [3, 1, 2], 1500, 
+                              RandomState(5), 'sample.trace')
+    assert syn_trace.flowsize == syn.flowsize
+    os.remove('sample.trace')